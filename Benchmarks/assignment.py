@@ -0,0 +1,112 @@
+'''
+Сравнение старого жадного распределения кандидатов по слотам с оптимальным (fast_distribute)
+на 15, 50 и 100 людях: время на кадр и доля кадров, где человек оказался не в своем слоте.
+
+    python -m Benchmarks.assignment
+    python -m Benchmarks.assignment --persons 15 50 100 --frames 300 --output assignment.json
+'''
+import sys
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+from numba import njit
+import Core.utilities.config as cfg
+from Core.utilities.fast_tools import fast_distribute
+from .mocks import SKELETON_TEMPLATE
+
+
+@njit(fastmath=True)
+def greedy_distribute(new_humans, slots, matrix, frame_steps, prev_persons_count, track_limb):
+    '''Прежняя реализация Tracker.distribute: глобальный argmin, затирание строки и столбца'''
+    cur_count = max(prev_persons_count[0], new_humans.shape[0])
+    est_mtrx = matrix[:min((slots.shape[0], cur_count)), :min(slots.shape[0], new_humans.shape[0])]
+    prev_persons_count[0] = cur_count
+    for i in range(est_mtrx.shape[0]):
+        for j in range(est_mtrx.shape[1]):
+            abs_diff = (np.abs(new_humans[j, track_limb[0]] - slots[i, frame_steps, track_limb[0]]) +
+                        np.abs(new_humans[j, track_limb[1]] - slots[i, frame_steps, track_limb[1]]))
+            est_mtrx[i, j] = abs_diff[0] + abs_diff[1]
+    for i in range(min(est_mtrx.shape)):
+        idx = np.argmin(est_mtrx)
+        row, col = (idx // est_mtrx.shape[1]), (idx % est_mtrx.shape[1])
+        slots[row, -1] = new_humans[col]
+        est_mtrx[row, :] = np.inf
+        est_mtrx[:, col] = np.inf
+
+
+def makeScene(persons_count, frames_count, frame_size=(1920, 1080), height=160, speed=8., seed=0):
+    '''Люди идут навстречу друг другу по плотной сцене, траектории часто пересекаются'''
+    rng = np.random.default_rng(seed)
+    width, frame_height = frame_size
+    position = rng.uniform((0, 0), (width - height, frame_height - height), (persons_count, 2))
+    velocity = rng.normal(0, speed, (persons_count, 2))
+    scene = np.empty((frames_count, persons_count, cfg.BODY_POINTS_NUM, 2), dtype=np.float32)
+    for t in range(frames_count):
+        position += velocity
+        bounce = (position < 0) | (position > (width - height, frame_height - height))
+        velocity[bounce] *= -1
+        scene[t] = SKELETON_TEMPLATE * height + position[:, None].astype(np.float32)
+        scene[t] += rng.normal(0, 1.5, scene[t].shape).astype(np.float32)
+    return scene
+
+
+def runScene(scene, greedy):
+    frames_count, persons_count = scene.shape[:2]
+    frame_steps = cfg.SEQ_LENGTH
+    slots = np.zeros((persons_count, frame_steps) + scene.shape[2:], dtype=np.float32)
+    matrix = np.full((persons_count, persons_count), np.inf, dtype=np.float32)
+    prev_count = np.array([0], dtype=np.int64)
+    anchors = np.zeros((persons_count, 2, 2), dtype=np.float32)
+    slot_state = np.zeros(persons_count, dtype=np.int8)
+    track_limb = np.uint8(cfg.TRACK_LIMB)
+    pre_last = np.uint16(frame_steps-2)
+    rng = np.random.default_rng(1)
+
+    elapsed, switches, owners = 0., 0, None
+    for t in range(frames_count):
+        order = rng.permutation(persons_count) # YOLO не сохраняет порядок людей между кадрами
+        new_humans = scene[t, order]
+        start = perf_counter()
+        if greedy:
+            greedy_distribute(new_humans, slots, matrix, pre_last, prev_count, track_limb)
+        else:
+            fast_distribute(new_humans, slots, frame_steps-1, anchors, matrix, prev_count, track_limb,
+                            np.float32(cfg.TRACK_MAX_DISTANCE), slot_state)
+        elapsed += perf_counter() - start
+        # кто сейчас в каждом слоте: ищем совпадение последнего кадра слота с истинными людьми
+        current = np.argmin(np.abs(slots[:prev_count[0], -1, None] - scene[t][None]).sum(axis=(2, 3)), axis=1)
+        if owners is not None:
+            switches += int((current[:len(owners)] != owners[:len(current)]).sum())
+        owners = current
+        slots[:, :-1] = slots[:, 1:] # у обоих вариантов новый кадр всегда последний
+        slots[:, -1] = 0.
+    return {'mean_ms': elapsed / frames_count * 1000, 'id_switches': switches,
+            'id_switch_rate': switches / (frames_count * persons_count)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Chii assignment benchmark')
+    parser.add_argument('--persons', type=int, nargs='*', default=[15, 50, 100])
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--output', help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    report = {}
+    for persons_count in args.persons:
+        scene = makeScene(persons_count, args.frames)
+        runScene(scene[:2], greedy=True) # компиляция не должна попадать в замеры
+        runScene(scene[:2], greedy=False)
+        report[persons_count] = {'greedy': runScene(scene, greedy=True),
+                                 'optimal': runScene(scene, greedy=False)}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+'''
+Шаг трекера до и после слияния: раздельные distribute + normalize + torch.FloatTensor
+против step: fast_associate и параллельное fast_normalize_pack, которое пишет окна прямо
+в буфер классификатора, и torch.from_numpy без копирования. Результаты обоих путей сверяются на каждом кадре.
+
+    python -m Benchmarks.fused
+    python -m Benchmarks.fused --persons 5 15 50 --frames 500 --output fused.json
+'''
+import sys
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+import torch
+import Core.utilities.config as cfg
+from Core.Tracker import Tracker
+from .assignment import makeScene
+
+
+def makeTracker(persons_count, frame_steps):
+    return Tracker(max_persons_count=persons_count, frame_steps=frame_steps,
+                   track_limb=cfg.TRACK_LIMB, human_shape=(cfg.BODY_POINTS_NUM, 2))
+
+
+def runScene(scene, frame_steps):
+    frames_count, persons_count = scene.shape[:2]
+    separate, fused = makeTracker(persons_count, frame_steps), makeTracker(persons_count, frame_steps)
+    # буферы классификатора сразу на потолок, емкость трекеров растет по ходу сцены
+    separate_output = np.zeros((persons_count, frame_steps, cfg.BODY_POINTS_NUM, 2), dtype=np.float32)
+    fused_output = np.zeros_like(separate_output)
+    rng = np.random.default_rng(1)
+
+    elapsed = {'separate': 0., 'fused': 0.}
+    for t in range(frames_count):
+        new_humans = scene[t, rng.permutation(persons_count)] # YOLO не сохраняет порядок людей
+
+        start = perf_counter()
+        separate.distribute(new_humans)
+        rects, Xs = separate.normalize(separate_output[:separate.getPersonsCount()])
+        data = torch.FloatTensor(Xs)
+        elapsed['separate'] += perf_counter() - start
+
+        start = perf_counter()
+        fused_rects, fused_Xs = fused.step(new_humans, fused_output)
+        fused_data = torch.from_numpy(fused_Xs)
+        elapsed['fused'] += perf_counter() - start
+
+        if not (np.array_equal(rects, fused_rects) and torch.equal(data, fused_data)):
+            raise AssertionError(f'Fused step diverged from the separate one on frame {t}')
+        separate.timeStep()
+        fused.timeStep()
+    return {name: seconds / frames_count * 1e6 for name, seconds in elapsed.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Chii fused tracker step benchmark')
+    parser.add_argument('--persons', type=int, nargs='*', default=[5, 15, 50])
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--frame-steps', type=int, default=cfg.SEQ_LENGTH)
+    parser.add_argument('--output', help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    report = {}
+    for persons_count in args.persons:
+        scene = makeScene(persons_count, args.frames)
+        runScene(scene[:2], args.frame_steps) # компиляция не должна попадать в замеры
+        timings = runScene(scene, args.frame_steps)
+        report[persons_count] = {'separate_us': timings['separate'], 'fused_us': timings['fused'],
+                                 'speedup': timings['separate'] / timings['fused']}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
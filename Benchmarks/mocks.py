@@ -0,0 +1,58 @@
+import numpy as np
+import Core.utilities.config as cfg
+from Core.PoseEstimator import stackPoses
+
+
+# скелет в формате YOLO17, координаты в долях от роста
+SKELETON_TEMPLATE = np.array([[0.50, 0.06], # нос
+                              [0.53, 0.04], [0.47, 0.04], # глаза
+                              [0.56, 0.06], [0.44, 0.06], # уши
+                              [0.62, 0.20], [0.38, 0.20], # плечи
+                              [0.66, 0.36], [0.34, 0.36], # локти
+                              [0.68, 0.50], [0.32, 0.50], # запястья
+                              [0.58, 0.52], [0.42, 0.52], # бедра
+                              [0.60, 0.74], [0.40, 0.74], # колени
+                              [0.61, 0.96], [0.39, 0.96]], # лодыжки
+                             dtype=np.float32)
+
+
+class MockPoseEstimator():
+    '''Заменяет PoseEstimator: люди ходят по кадру туда-обратно с небольшим дрожанием точек.
+    Детерминирован по seed, поэтому прогоны бенчмарков сравнимы между собой'''
+    def __init__(self, persons_count=5, frame_size=(1280, 720), height=240, jitter=2., seed=0):
+        self.persons_count = persons_count
+        self.width, self.frame_height = frame_size
+        self.height = height
+        self.jitter = jitter
+        self.imgsz = cfg.POSE_IMGSZ
+        self.__rng = np.random.default_rng(seed)
+        self.__step = 0
+        self.__x = self.__rng.uniform(0, self.width - height, persons_count)
+        self.__y = self.__rng.uniform(0, self.frame_height - height, persons_count)
+        self.__vx = self.__rng.uniform(-6, 6, persons_count)
+
+    def setInputSize(self, imgsz):
+        self.imgsz = imgsz
+
+    def getKeypoints(self):
+        self.__step += 1
+        self.__x += self.__vx
+        bounce = (self.__x < 0) | (self.__x > self.width - self.height)
+        self.__vx[bounce] *= -1
+        keypoints = np.empty((self.persons_count, cfg.BODY_POINTS_NUM, 3), dtype=np.float32)
+        keypoints[:, :, :2] = SKELETON_TEMPLATE * self.height
+        keypoints[:, :, 0] += self.__x[:, None]
+        keypoints[:, :, 1] += self.__y[:, None]
+        keypoints[:, :, :2] += self.__rng.normal(0, self.jitter, (self.persons_count, cfg.BODY_POINTS_NUM, 2))
+        keypoints[:, :, 2] = 0.9
+        order = self.__rng.permutation(self.persons_count) # YOLO не обязан сохранять порядок людей
+        return keypoints[order]
+
+    def processFrame(self, frame, render=True):
+        keypoints = self.getKeypoints()
+        boxes = np.concatenate([keypoints[:, :, :2].min(axis=1), keypoints[:, :, :2].max(axis=1)], axis=1)
+        return (frame.copy() if render else None), keypoints, boxes
+
+    def processFrames(self, frames, render=False):
+        renders = render if isinstance(render, (list, tuple)) else [render] * len(frames)
+        return stackPoses([self.processFrame(frame, render) for frame, render in zip(frames, renders)])
@@ -0,0 +1,178 @@
+'''
+Офлайн-бенчмарк всего конвейера Core.Main на записанных видео или синтетических кадрах.
+Кадры прогоняются без пропусков с максимальной скоростью, результат - JSON с пропускной способностью
+и перцентилями задержек по стадиям и пиковой памятью.
+
+    python -m Benchmarks.pipeline --synthetic 600 --output bench.json
+    python -m Benchmarks.pipeline __Inputs/check.mp4 --pose real --output bench.json
+    python -m Benchmarks.pipeline __Inputs/check.mp4 --pose real --backend onnx --baseline bench.json
+    python -m Benchmarks.pipeline --synthetic 600 --baseline bench.json --tolerance 0.1
+'''
+import os
+import sys
+import json
+import platform
+import argparse
+from time import time
+import cv2
+import numpy as np
+import Core.utilities.config as cfg
+from Core.Main import Main
+from Core.utilities.metrics import METRICS
+from .mocks import MockPoseEstimator
+
+
+LATENCY_KEYS = ('p50', 'p95', 'p99')
+
+
+def getPeakRSS():
+    '''Пиковая резидентная память процесса в байтах'''
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # в linux килобайты
+    except ImportError: # windows
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+
+
+def iterVideoFrames(paths, max_frames=None):
+    count = 0
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f'Cannot open video source: {path}')
+        try:
+            while max_frames is None or count < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                count += 1
+                yield frame
+        finally:
+            cap.release()
+
+
+def iterSyntheticFrames(count, frame_size=(1280, 720), seed=0):
+    rng = np.random.default_rng(seed)
+    frames = [rng.integers(0, 255, (frame_size[1], frame_size[0], 3), dtype=np.uint8) for _ in range(8)]
+    for i in range(count):
+        yield frames[i % len(frames)]
+
+
+def runBenchmark(frames, pose='mock', persons_count=5, warmup=30, main_params=None, stream_id='benchmark',
+                 backend=cfg.POSE_BACKEND):
+    if pose == 'mock':
+        pose_estimator = MockPoseEstimator(persons_count=persons_count)
+    else:
+        from Core.PoseEstimator import PoseEstimator
+        pose_estimator = PoseEstimator(backend=backend) # настоящий YOLO на выбранном рантайме
+
+    weights = cfg.CLASSIF_MODEL if os.path.exists(cfg.CLASSIF_MODEL) else None # без весов время то же
+    params = dict(names_of_classes=cfg.CLASSES,
+                  max_persons_count=cfg.MAX_PERSON_COUNT,
+                  frame_steps=cfg.SEQ_LENGTH,
+                  classifier_neurons=cfg.CLASSIFIER_NEURONS,
+                  classifier_weights_path=weights,
+                  pose_estimator=pose_estimator,
+                  stream_id=f'{stream_id}-warmup')
+    params.update(main_params or {})
+    model = Main(**params)
+
+    frames = iter(frames)
+    for _, frame in zip(range(warmup), frames): # прогрев torch/numba не должен попадать в метрики
+        model.processFrame(frame)
+    METRICS.removeStream(model.stream_id)
+    model.stream_id = stream_id
+    METRICS.removeStream(stream_id)
+
+    count, start = 0, time()
+    for frame in frames:
+        model.processFrame(frame)
+        count += 1
+    elapsed = time() - start
+
+    stages = {}
+    for stage, stats in METRICS.getSummary(stream_id).get(stream_id, {}).items():
+        stages[stage] = {'count': stats['count'],
+                         'throughput_fps': 1. / stats['mean'] if stats['mean'] else None,
+                         'mean': stats['mean']}
+        stages[stage].update({key: stats[key] for key in LATENCY_KEYS})
+    return {'frames': count,
+            'elapsed_seconds': elapsed,
+            'fps': count / elapsed if elapsed else None,
+            'peak_rss_bytes': getPeakRSS(),
+            'stages': stages,
+            'config': {'pose': pose,
+                       'persons_count': persons_count if pose == 'mock' else None,
+                       'backend': backend if pose == 'real' else None,
+                       'warmup': warmup,
+                       'python': platform.python_version(),
+                       'machine': platform.machine()}}
+
+
+def compareWithBaseline(report, baseline, tolerance=0.1, min_delta=0.0005):
+    '''Список регрессий: задержки выросли или FPS упал больше чем на tolerance.
+    Рост задержки меньше min_delta секунд считается шумом (важно для микросекундных стадий)'''
+    regressions = []
+    if baseline.get('fps') and report['fps'] < baseline['fps'] * (1 - tolerance):
+        regressions.append({'stage': 'total', 'metric': 'fps',
+                            'baseline': baseline['fps'], 'current': report['fps']})
+    for stage, stats in report['stages'].items():
+        base_stats = baseline.get('stages', {}).get(stage)
+        if not base_stats:
+            continue
+        for key in LATENCY_KEYS:
+            if (base_stats.get(key) and stats[key] > base_stats[key] * (1 + tolerance)
+                    and stats[key] - base_stats[key] > min_delta):
+                regressions.append({'stage': stage, 'metric': key,
+                                    'baseline': base_stats[key], 'current': stats[key]})
+    peak, base_peak = report['peak_rss_bytes'], baseline.get('peak_rss_bytes')
+    if base_peak and peak > base_peak * (1 + tolerance):
+        regressions.append({'stage': 'total', 'metric': 'peak_rss_bytes', 'baseline': base_peak, 'current': peak})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Chii pipeline benchmark')
+    parser.add_argument('videos', nargs='*', help='Video files to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='Number of synthetic frames if no videos given')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--pose', choices=('mock', 'real'), default='mock')
+    parser.add_argument('--backend', choices=('torch', 'onnx', 'openvino', 'onnx_int8'), default=cfg.POSE_BACKEND,
+                        help='Runtime for the real pose estimator')
+    parser.add_argument('--persons', type=int, default=5, help='Persons per frame for the mock pose estimator')
+    parser.add_argument('--warmup', type=int, default=30)
+    parser.add_argument('--output', help='Where to write the JSON report')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative slowdown')
+    parser.add_argument('--min-delta', type=float, default=0.0005, help='Latency growth in seconds ignored as noise')
+    args = parser.parse_args()
+
+    if args.videos:
+        frames = iterVideoFrames(args.videos, args.max_frames)
+    else:
+        frames = iterSyntheticFrames(args.synthetic or 600)
+
+    report = runBenchmark(frames, pose=args.pose, persons_count=args.persons, warmup=args.warmup,
+                          backend=args.backend)
+    report['inputs'] = args.videos or f'synthetic:{args.synthetic or 600}'
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        report['regressions'] = compareWithBaseline(report, baseline, args.tolerance, args.min_delta)
+        exit_code = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,8 @@ commands = []
 m = Main(max_persons_count=cfg.MAX_PERSON_COUNT,
          names_of_classes=cfg.CLASSES,
          frame_steps=cfg.SEQ_LENGTH,
-         classifier_neurons=cfg.CLASSIFIER_NEURONS)
+         classifier_neurons=cfg.CLASSIFIER_NEURONS,
+         headless=True) # рисуем кадры, только если подключено превью (attachViewer)
 
 #m.start() # ОСТОРОЖНО, МОЖНО ПОВИСНУТЬ ПОСЛЕ ИМПОРТА, ЕСЛИ В ГЛАВНОМ ФАЙЛЕ ЧТО-ТО ПОЙДЕТ НЕ ТАК
 
@@ -31,6 +32,8 @@ def mainloop():
     height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
     print('width, height:', width, height)
     previewVideo = True
+    if previewVideo:
+        m.attachViewer()
 
     try:
         m.start() # запускаем отдельный поток
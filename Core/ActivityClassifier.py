@@ -83,7 +83,11 @@ class ActivityClassifier():
     def predictAction(self, points, threshold=0.5, transform=None):
         if transform:
             pass # TBC
-        data = torch.FloatTensor(points)
+        if isinstance(points, np.ndarray) and points.dtype == np.float32 and points.flags.c_contiguous \
+                and points.flags.writeable:
+            data = torch.from_numpy(points) # буфер трекера без копирования
+        else:
+            data = torch.FloatTensor(points)
         data = data.to(self.device)
         self.net.eval()
         return self.net.predict(data).cpu() # > theshold
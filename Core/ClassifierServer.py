@@ -0,0 +1,70 @@
+import torch
+import numpy as np
+from .ActivityClassifier import ActivityClassifier
+from .utilities.batching import BatchServer
+from Core.utilities import config as cfg
+
+
+class ClassifierClient():
+    '''Заменяет ActivityClassifier внутри Main: окна людей уходят в общий батч сервера'''
+    def __init__(self, server, stream_id=None):
+        self.server = server
+        self.stream_id = stream_id
+
+    def predictAction(self, points, threshold=0.5, transform=None):
+        return self.server.submit(points).wait()
+
+
+class ClassifierServer(BatchServer):
+    '''Один классификатор на все камеры: окна людей из разных потоков склеиваются в один батч,
+    размер которого округляется вверх до ближайшей корзины, чтобы форма входа не менялась'''
+    def __init__(self,
+                 num_of_classes=len(cfg.CLASSES),
+                 input_size=cfg.BODY_POINTS_NUM*cfg.BODY_POINTS_DIM,
+                 seq_length=cfg.SEQ_LENGTH,
+                 hidden_layer_size=cfg.CLASSIFIER_NEURONS,
+                 weights_path=cfg.CLASSIF_MODEL,
+                 max_batch_size=cfg.CLASSIFIER_SERVER_MAX_BATCH,
+                 max_wait=cfg.CLASSIFIER_SERVER_MAX_WAIT,
+                 buckets=cfg.CLASSIFIER_BATCH_BUCKETS,
+                 activity_classifier=None):
+        BatchServer.__init__(self, max_batch_size=max_batch_size, max_wait=max_wait)
+        if activity_classifier is not None:
+            self.ac = activity_classifier
+        else:
+            self.ac = ActivityClassifier(num_of_classes,
+                                         input_size=input_size,
+                                         seq_length=seq_length,
+                                         hidden_layer_size=hidden_layer_size,
+                                         weights_path=weights_path)
+        self.buckets = sorted(buckets)
+        self.__padded = {} # буферы под каждую корзину, чтобы не выделять память на каждый батч
+
+    def getClient(self, stream_id=None):
+        return ClassifierClient(self, stream_id)
+
+    def getBucket(self, size):
+        for bucket in self.buckets:
+            if size <= bucket:
+                return bucket
+        return self.buckets[-1]
+
+    def __predictChunk(self, points):
+        bucket = self.getBucket(len(points))
+        key = (bucket,) + points.shape[1:]
+        if key not in self.__padded:
+            self.__padded[key] = np.zeros(key, dtype=np.float32)
+        padded = self.__padded[key]
+        padded[:len(points)] = points
+        padded[len(points):] = 0.
+        return self.ac.predictAction(padded)[:len(points)]
+
+    def processBatch(self, windows):
+        sizes = [len(points) for points in windows]
+        points = np.concatenate(windows)
+        largest = self.buckets[-1]
+        with torch.no_grad():
+            # если людей больше самой большой корзины, гоняем несколькими порциями
+            results = torch.cat([self.__predictChunk(points[i:i+largest]) 
+                                 for i in range(0, len(points), largest)])
+        return list(torch.split(results, sizes))
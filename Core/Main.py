@@ -3,15 +3,46 @@ import cv2
 import numpy as np
 import pandas as pd
 from time import time
-from threading import Thread
+from threading import Thread, Condition, Lock
+from collections import namedtuple
+from types import MappingProxyType
 from .ActivityClassifier import *
 from .Tracker import *
 from .PoseEstimator import *
 from .utilities.tools import *
-from .utilities.fast_tools import fast_personwise_normalize_all
+from .utilities.pipeline import StageQueue, Stage
+from .utilities.cache import ClassificationCache
+from .utilities.motion import MotionGate
+from .utilities.transforms import ZoneCropper
+from .utilities.metrics import METRICS
 import Core.utilities.config as cfg
 
 
+class FrameResult(namedtuple('FrameResult', ['frame_id', 'capture_time', 'published_time', 'timings',
+                                             'frame', 'classes', 'probs', 'bboxes', 'track_ids'])):
+    '''Неизменяемый результат обработки одного кадра, публикуется целиком одной ссылкой.
+    Поддерживает и старый доступ как к словарю: result['frame'], result.get('classes').
+    classes, probs, bboxes и track_ids - только треки, найденные на этом кадре, без предсказанных Калманом'''
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+EMPTY_RESULT = FrameResult(0, None, None, MappingProxyType({}), None, None, None, None, None)
+
+
+def readOnly(array):
+    if array is not None:
+        array.flags.writeable = False
+    return array
+
+
 class Main(Thread):
     def __init__(self, 
                  names_of_classes, 
@@ -23,20 +54,42 @@ class Main(Thread):
                  classifier_neurons=512, 
                  classifier_threshold=0.5,
                  classifier_transform=None,
-                 classifier_weights_path=cfg.CLASSIF_MODEL):
+                 classifier_weights_path=cfg.CLASSIF_MODEL,
+                 pipelined=False,
+                 queue_depth=cfg.PIPELINE_QUEUE_DEPTH,
+                 drop_policy=cfg.PIPELINE_DROP_POLICY,
+                 pose_estimator=None,
+                 activity_classifier=None,
+                 headless=False,
+                 scheduler=None,
+                 classifier_cadence=cfg.CLASSIFIER_CADENCE,
+                 classifier_motion_threshold=cfg.CLASSIFIER_MOTION_THRESHOLD,
+                 stream_id=None,
+                 motion_gate=None,
+                 zones=None,
+                 detect_interval=cfg.POSE_DETECT_INTERVAL,
+                 crop_margin=cfg.POSE_CROP_MARGIN,
+                 crop_imgsz=cfg.POSE_CROP_IMGSZ):
         Thread.__init__(self)      
-        self.pe = PoseEstimator()
+        self.stream_id = stream_id if stream_id is not None else self.name # метка потока в метриках
+        if pose_estimator is not None: # например, клиент общего PoseServer
+            self.pe = pose_estimator
+        else:
+            self.pe = PoseEstimator(**(pose_estimator_params or {}))
         
         self.tr = Tracker(max_persons_count=max_persons_count, 
                           frame_steps=frame_steps,
                           human_shape=human_shape, 
                           track_limb=track_limb)
         
-        self.ac = ActivityClassifier(len(names_of_classes),
-                                     input_size=human_shape[0]*human_shape[1],
-                                     seq_length=frame_steps,
-                                     hidden_layer_size=classifier_neurons,
-                                     weights_path=classifier_weights_path)
+        if activity_classifier is not None: # например, клиент общего ClassifierServer
+            self.ac = activity_classifier
+        else:
+            self.ac = ActivityClassifier(len(names_of_classes),
+                                         input_size=human_shape[0]*human_shape[1],
+                                         seq_length=frame_steps,
+                                         hidden_layer_size=classifier_neurons,
+                                         weights_path=classifier_weights_path)
         self.human_shape = human_shape
         self.names_of_classes = names_of_classes
         self.rect_colors = (len(names_of_classes)-1)*[(255, 255, 255)] + [(0, 0, 255)]
@@ -44,59 +97,424 @@ class Main(Thread):
         # Для многопоточности
         self.__is_alive = False
         self.__current_frame = None
+        self.__current_capture_time = None
+        # почтовый ящик на один кадр: поток-производитель кладет, run забирает
+        self.__frame_cond = Condition()
+        self.__frame_id = 0 # номер последнего положенного кадра
+        self.__processed_frame_id = 0 # номер последнего обработанного кадра
+        self.__dropped_frames = 0 # кадры, которые перезаписали до обработки
+        self.__processed_count = 0 # сколько кадров прошло все стадии
         self.__classifier_threshold = classifier_threshold
         self.tr.resetState()
         self.__classifier_transform = classifier_transform
         self.__dummy_slots = self.tr.getSlotsCopy() # сюда будут помещаться нормализованные скелеты людей
-        self.__output = {'frame': None, 
-                         'classes': None,
-                         'bboxes': None}
+        if classifier_cadence > 1: # иначе классифицируем всех на каждом кадре
+            self.cache = ClassificationCache(self.tr.getCapacity(), len(names_of_classes), human_shape,
+                                             classifier_cadence, classifier_motion_threshold)
+        else:
+            self.cache = None
+        self.__output = EMPTY_RESULT
+        self.__output_cond = Condition() # будит тех, кто ждет следующий результат
+        # конвейерный режим: каждая стадия в своем потоке, между ними ограниченные очереди
+        self.__pipelined = pipelined
+        self.__queue_depth = queue_depth
+        self.__drop_policy = drop_policy
+        self.__queues = {}
+        # без зрителей (превью, /video_feed) в headless режиме кадр не рисуется вовсе
+        self.__headless = headless
+        self.__viewers_count = 0
+        self.__viewers_lock = Lock()
+        # планировщик частоты: получает время обработки кадров и переключает уровни деградации
+        self.scheduler = scheduler
+        self.__level = None
+        self.__max_candidates = max_persons_count # сколько детекций YOLO отдаем трекеру
+        # пропуск YOLO на статичных кадрах, пока никого не отслеживаем (True - с настройками из конфига)
+        self.motion_gate = MotionGate() if motion_gate is True else motion_gate
+        self.__no_persons = np.zeros((0, human_shape[0], 3), dtype=np.float32)
+        # зоны интереса камеры: в YOLO уходят только они (ZoneCropper или словарь конфига)
+        self.zones = ZoneCropper.fromConfig(zones) if isinstance(zones, dict) else zones
+        # полная детекция раз в detect_interval кадров, между ними только вырезки вокруг рамок трекера
+        self.__detect_interval = detect_interval
+        self.__crop_margin = crop_margin
+        self.__crop_imgsz = crop_imgsz
+        self.__imgsz = getattr(self.pe, 'imgsz', cfg.POSE_IMGSZ) # вход для полного кадра
+        self.__frames_since_detect = 0
+        self.__track_rects = [] # рамки людей на последнем кадре, их пишет trackStage
+        self.__force_detect = True
+        self.__stages = [(name, self.__timedStage(name, func)) 
+                         for name, func in (('pose', self.poseStage), 
+                                            ('track', self.trackStage),
+                                            ('classify', self.classifyStage),
+                                            ('render', self.renderStage))]
     
     # ----------------- Тест многопоточности -----------------
     
-    def setFrame(self, img):
-        self.__current_frame = img
+    def setFrame(self, img, capture_time=None):
+        with self.__frame_cond:
+            if self.__current_frame is not None: # предыдущий кадр так и не забрали
+                self.__dropped_frames += 1
+            self.__current_frame = img
+            self.__current_capture_time = capture_time if capture_time is not None else time()
+            self.__frame_id += 1
+            self.__frame_cond.notify()
 
     def getOutput(self):
         return self.__output
 
+    def waitOutput(self, after_id=0, timeout=None):
+        '''Ждет результат с frame_id > after_id, возвращает None по таймауту или после stop'''
+        with self.__output_cond:
+            self.__output_cond.wait_for(lambda: self.__output.frame_id > after_id or not self.__is_alive, timeout)
+            return self.__output if self.__output.frame_id > after_id else None
+
+    def getFrameId(self):
+        return self.__frame_id
+
+    def getProcessedFrameId(self):
+        return self.__processed_frame_id
+
+    def getProcessedCount(self):
+        return self.__processed_count
+
+    def getDroppedCount(self):
+        return self.__dropped_frames
+
     def stop(self):
-        self.__is_alive = False # после этого цикл будет завершен
+        with self.__frame_cond:
+            self.__is_alive = False # после этого цикл будет завершен
+            self.__frame_cond.notify_all() # будим run, если он ждет кадр
+        with self.__output_cond:
+            self.__output_cond.notify_all() # и тех, кто ждет результат
+
+    def takeFrame(self):
+        '''Блокируется до прихода нового кадра, возвращает пакет кадра или None после stop'''
+        with self.__frame_cond:
+            self.__frame_cond.wait_for(lambda: self.__current_frame is not None or not self.__is_alive)
+            if not self.__is_alive:
+                return None
+            packet = self.__makePacket(self.__frame_id, self.__current_frame, self.__current_capture_time)
+            self.__current_frame = None # кадр забран, повторно его не обработаем
+            self.__processed_frame_id = self.__frame_id
+            return packet
+
+    def attachViewer(self):
+        with self.__viewers_lock:
+            self.__viewers_count += 1
+
+    def detachViewer(self):
+        with self.__viewers_lock:
+            self.__viewers_count = max(0, self.__viewers_count-1)
+
+    def isRendering(self):
+        return not self.__headless or self.__viewers_count > 0
+
+    def applyLevel(self, level):
+        '''Применяет уровень лестницы деградации: размер входа YOLO и число отслеживаемых кандидатов'''
+        if hasattr(self.pe, 'setInputSize'):
+            self.pe.setInputSize(level['imgsz'])
+            self.__imgsz = level['imgsz']
+        self.__max_candidates = level['max_persons']
+        self.__level = level
+
+    def getQueueDepths(self):
+        return {name: len(queue) for name, queue in self.__queues.items()}
+
+    def getQueueDrops(self):
+        return {name: queue.dropped for name, queue in self.__queues.items()}
+
+    # ----------------- Стадии обработки кадра -----------------
+    # каждая стадия принимает и возвращает словарь-пакет с данными одного кадра
+
+    def poseStage(self, packet):
+        packet['render'] = self.isRendering() # решение принимается один раз на кадр для всех стадий
+        if self.motion_gate is not None:
+            # при отслеживаемых людях кадр анализируется всегда, но становится эталоном для сравнения
+            tracking = self.tr.getPersonsCount() > 0
+            if not self.motion_gate.check(packet['frame'], packet['capture_time'], force=tracking):
+                # сцена пуста и неподвижна: трекер просто сделает шаг без новых детекций
+                packet['img'] = packet['frame'].copy() if packet['render'] else None
+                packet['persons'], packet['rects'] = self.__no_persons, []
+                return packet
+        track_rects = self.__track_rects
+        if self.__needsDetection(track_rects):
+            self.__frames_since_detect = 0
+            self.__force_detect = False
+        else:
+            packet['img'], packet['persons'], packet['rects'] = self.__processCrops(packet['frame'], 
+                                                                                    packet['render'],
+                                                                                    track_rects)
+            return packet
+        if self.zones is not None:
+            packet['img'], packet['persons'], packet['rects'] = self.__processZones(packet['frame'], 
+                                                                                    packet['render'])
+        else:
+            packet['img'], packet['persons'], packet['rects'] = self.pe.processFrame(packet['frame'], 
+                                                                                     packet['render'])
+        return packet
+
+    def __needsDetection(self, track_rects):
+        self.__frames_since_detect += 1
+        return (self.__detect_interval <= 1 or self.__force_detect or not len(track_rects)
+                or self.__frames_since_detect >= self.__detect_interval) # новые люди появляются только так
+
+    def __processCrops(self, frame, render, track_rects):
+        '''YOLO только на вырезках вокруг прошлых рамок, одним батчем. Из каждой вырезки берется
+        человек, ближайший к центру рамки; если кого-то не нашли, следующий кадр пойдет на полную детекцию'''
+        height, width = frame.shape[:2]
+        crops, offsets, centers = [], [], []
+        for left, top, right, bottom in track_rects:
+            dx, dy = (right-left) * self.__crop_margin, (bottom-top) * self.__crop_margin
+            x1, y1 = max(0, int(left-dx)), max(0, int(top-dy))
+            x2, y2 = min(width, int(right+dx)+1), min(height, int(bottom+dy)+1)
+            if x2 <= x1 or y2 <= y1: # рамка ушла за край кадра: трек потерян, пустую вырезку YOLO не переварит
+                self.__force_detect = True
+                continue
+            crops.append(frame[y1:y2, x1:x2])
+            offsets.append((x1, y1))
+            centers.append(((left+right)/2 - x1, (top+bottom)/2 - y1))
+        if not crops:
+            return (frame.copy() if render else None, self.__no_persons, np.zeros((0, 4), dtype=np.float32))
+
+        images, keypoints, boxes, counts = self.__processSized(crops, render, self.__crop_imgsz)
+
+        persons = np.zeros((len(crops), self.human_shape[0], 3), dtype=np.float32)
+        rects = np.zeros((len(crops), 4), dtype=np.float32)
+        found = counts > 0
+        for i in np.flatnonzero(found):
+            box = boxes[i, :counts[i]]
+            distances = np.abs((box[:, 0]+box[:, 2])/2 - centers[i][0]) + np.abs((box[:, 1]+box[:, 3])/2 - centers[i][1])
+            j = np.argmin(distances)
+            visible = (keypoints[i, j, :, 0] > 0) | (keypoints[i, j, :, 1] > 0) # нули трекер считает ненайденными
+            persons[i] = keypoints[i, j]
+            persons[i, :, 0] += offsets[i][0] * visible
+            persons[i, :, 1] += offsets[i][1] * visible
+            rects[i] = box[j] + (offsets[i] * 2)
+        if not found.all():
+            self.__force_detect = True
+
+        img = None
+        if render:
+            img = frame.copy()
+            for image, crop, (x1, y1) in zip(images, crops, offsets):
+                img[y1:y1+crop.shape[0], x1:x1+crop.shape[1]] = image
+        return img, persons[found], rects[found]
+
+    def __processSized(self, frames, render, imgsz):
+        '''Батч YOLO со своим размером входа, после него возвращается вход для полного кадра'''
+        if not hasattr(self.pe, 'setInputSize'):
+            return self.pe.processFrames(frames, render)
+        self.pe.setInputSize(imgsz)
+        try:
+            return self.pe.processFrames(frames, render)
+        finally:
+            self.pe.setInputSize(self.__imgsz)
+
+    def __processZones(self, frame, render):
+        # вход по размеру зон: с полным imgsz LetterBox растянул бы каждую уменьшенную зону обратно
+        images, keypoints, boxes, counts = self.__processSized(self.zones(frame), render,
+                                                               self.zones.getInputSize(self.__imgsz))
+        persons, rects = [self.__no_persons], [np.zeros((0, 4), dtype=np.float32)]
+        for i, count in enumerate(counts):
+            if count: # копии, потому что буферы processFrames переиспользуются
+                kps, bxs = self.zones.toFrame(i, keypoints[i, :count].copy(), boxes[i, :count].copy())
+                persons.append(kps)
+                rects.append(bxs)
+        persons, rects = np.concatenate(persons), np.concatenate(rects)
+        order = np.argsort(-persons[:, :, 2].mean(axis=1), kind='stable') # как у YOLO, самые уверенные первыми
+        img = None
+        if render:
+            img = frame.copy()
+            for i, image in enumerate(images):
+                self.zones.paste(img, i, image)
+            self.zones.drawOutlines(img)
+        return img, persons[order], rects[order]
+
+    def trackStage(self, packet):
+        persons = packet['persons'][:self.__max_candidates] # YOLO сортирует по уверенности
+        if persons.size == 0: # пустой результат YOLO бывает и (1, 0, 51), и (0, 17, 3)
+            persons = self.__no_persons # треки все равно должны отметить пропуск кадра
+        start = time()
+        capacity = self.tr.reserve(len(persons)) # слоты трекера растут и сжимаются, буфер следует за ними
+        if len(self.__dummy_slots) != capacity:
+            self.__dummy_slots = self.tr.getSlotsCopy()
+        packet['capacity'] = capacity
+        # распределение, нормализация нового кадра и сборка окон в буфер классификатора - одно ядро
+        rects, Xs = self.tr.step(persons[:, :self.human_shape[0], :2], self.__dummy_slots) # отпиливыем вероятности срезом
+        packet['subtimings']['track_step'] = time() - start
+        if self.tr.getPersonsCount():
+            if self.__pipelined: # буфер перезапишется следующим кадром, пока классификатор работает
+                Xs = Xs.copy()
+            packet['rects'] = rects # ПОДМЕНА НА НАШИ РАМКИ
+            packet['Xs'] = Xs
+            packet['track_ids'] = self.tr.getTrackIds().copy() # после timeStep треки могут переехать
+            # пропавшие треки Калман ведет по предсказанию: их классифицируем, но не публикуем и не рисуем
+            packet['confirmed'] = np.flatnonzero(self.tr.getTrackMisses() == 0)
+            if self.__detect_interval > 1: # по ним следующий кадр режется на вырезки
+                self.__track_rects = self.__cropRects(rects, self.tr.getTrackMisses(), packet['frame'].shape)
+        else:
+            packet['Xs'] = packet['track_ids'] = packet['confirmed'] = None
+            self.__track_rects = []
+        self.tr.timeStep() # здесь же удаляются потерянные треки
+        return packet
+
+    @staticmethod
+    def __cropRects(rects, misses, frame_shape):
+        '''Рамки для вырезок следующего кадра: только треки, найденные на этом кадре и видимые в нем.
+        Предсказанное Калманом положение пропавшего трека может уйти за край кадра'''
+        height, width = frame_shape[:2]
+        return [rect for rect, miss in zip(rects, misses)
+                if miss == 0 and rect[2] > rect[0] and rect[3] > rect[1]
+                and rect[2] > 0 and rect[3] > 0 and rect[0] < width and rect[1] < height]
+
+    def classifyStage(self, packet):
+        Xs = packet['Xs']
+        if Xs is not None and self.cache is not None:
+            if self.cache.getCapacity() != packet['capacity']: # емкость из пакета: в конвейере трекер уже впереди
+                self.cache.resize(packet['capacity'])
+            stale = self.cache.getStale(Xs, packet['track_ids']) # остальным достанется прошлый результат
+            if len(stale):
+                self.cache.update(stale,
+                                  self.ac.predictAction(Xs if len(stale) == len(Xs) else Xs[stale], 
+                                                        self.__classifier_threshold, 
+                                                        self.__classifier_transform),
+                                  Xs,
+                                  packet['track_ids'])
+            packet['results'] = self.cache.getResults(len(Xs))
+        elif Xs is not None:
+            packet['results'] = self.ac.predictAction(Xs, 
+                                                      self.__classifier_threshold, 
+                                                      self.__classifier_transform)
+        else:
+            packet['results'] = None
+            if self.cache is not None: # треков не осталось, слоты займут другие люди
+                self.cache.reset()
+        packet['classes'] = packet['results'].argmax(dim=1) if Xs is not None else None # выбираем классы для всех людей
+        return packet
+
+    def renderStage(self, packet):
+        img, rects = packet['img'], packet['rects']
+        classes, results, track_ids = packet['classes'], packet['results'], packet['track_ids']
+        if classes is not None and packet['render']:
+            for i in packet['confirmed']:
+                class_id = classes[i]
+                conf = results[i][class_id]
+                if conf > self.__classifier_threshold:
+                    img = drawRectangle(img, 
+                                        *rects[i], 
+                                        rect_color=self.rect_colors[class_id],
+                                        title=f'ID:{track_ids[i]} | {self.names_of_classes[class_id]}: {conf:.2f}')
+                else:
+                    img = drawRectangle(img, *rects[i], rect_color=self.rect_colors[-1],
+                                        title=f'ID:{track_ids[i]} | {self.names_of_classes[-1]}: {conf:.2f}')
+        packet['img'] = img # в headless режиме без зрителей здесь None
+        return None
+
+    def __timedStage(self, name, func):
+        def timedStage(packet):
+            start = time()
+            result = func(packet)
+            packet['timings'][name] = time() - start
+            if result is None: # последняя стадия, кадр обработан
+                self.__frameDone(packet)
+            return result
+        return timedStage
+
+    def __publish(self, packet):
+        classes = packet['classes']
+        if classes is not None:
+            confirmed = packet['confirmed'] # только треки, найденные детектором на этом кадре
+            result = FrameResult(packet['frame_id'], packet['capture_time'], time(),
+                                 MappingProxyType(packet['timings']),
+                                 readOnly(packet['img']),
+                                 tuple(classes[confirmed].tolist()),
+                                 readOnly(packet['results'].detach().numpy()[confirmed]),
+                                 tuple(tuple(float(x) for x in packet['rects'][i]) for i in confirmed),
+                                 tuple(packet['track_ids'][confirmed].tolist()))
+        else:
+            result = FrameResult(packet['frame_id'], packet['capture_time'], time(),
+                                 MappingProxyType(packet['timings']),
+                                 readOnly(packet['img']), None, None, None, None)
+        with self.__output_cond:
+            self.__processed_count += 1
+            if result.frame_id > self.__output.frame_id: # в конвейере старый кадр не должен затереть новый
+                self.__output = result
+            self.__output_cond.notify_all()
+
+    def __frameDone(self, packet):
+        self.__publish(packet)
+        for stage, seconds in packet['timings'].items():
+            METRICS.observe(self.stream_id, stage, seconds)
+        for stage, seconds in packet['subtimings'].items():
+            METRICS.observe(self.stream_id, stage, seconds)
+        METRICS.observe(self.stream_id, 'glass_to_glass', time() - packet['capture_time'])
+        METRICS.setGauge('dropped_frames', self.stream_id, self.getDroppedCount())
+        if self.motion_gate is not None:
+            METRICS.setGauge('pose_skipped_frames', self.stream_id, self.motion_gate.skipped)
+        for name, queue in list(self.__queues.items()):
+            METRICS.setGauge('queue_depth', self.stream_id, len(queue), queue=name)
+            METRICS.setGauge('queue_dropped', self.stream_id, queue.dropped, queue=name)
+
+        if self.scheduler is not None:
+            timings = packet['timings'].values()
+            # в конвейере пропускную способность ограничивает самая медленная стадия
+            level = self.scheduler.reportLatency(max(timings) if self.__pipelined else sum(timings))
+            if level is not self.__level:
+                self.applyLevel(level)
 
     def run(self):
         self.__is_alive = True
+        if self.scheduler is not None:
+            self.applyLevel(self.scheduler.getLevel())
+        if self.__pipelined:
+            self.__runPipelined()
+        else:
+            self.__runSequential()
+
+    def processFrame(self, img, capture_time=None):
+        '''Синхронная обработка кадра в вызывающем потоке (офлайн-обработка, бенчмарки)'''
+        with self.__frame_cond:
+            self.__frame_id += 1
+            self.__processed_frame_id = frame_id = self.__frame_id
+        self.__processPacket(self.__makePacket(frame_id, img, capture_time if capture_time is not None else time()))
+        return self.getOutput()
+
+    def __makePacket(self, frame_id, img, capture_time):
+        return {'frame_id': frame_id,
+                'frame': img,
+                'capture_time': capture_time,
+                'timings': {}, # время стадий верхнего уровня
+                'subtimings': {}} # время шагов внутри стадий
+
+    def __processPacket(self, packet):
+        for _, stage in self.__stages:
+            packet = stage(packet)
+
+    def __runSequential(self):
         while self.__is_alive:
-            if self.__current_frame is None:
-                continue
-            #start = time() 
-            img, persons, rects = self.pe.processFrame(self.__current_frame)
-            if persons.shape[1] != 0: # НЕ ТРОГАЙТЕ, ТАК НАДО
-                self.tr.distribute(persons[:, :self.human_shape[0], :2]) # отпиливыем вероятности срезом
-                rects_, Xs = fast_personwise_normalize_all(self.tr.getPersons(),
-                                                      self.__dummy_slots[:self.tr.getPersonsCount()])                
-                results = self.ac.predictAction(Xs, 
-                                                self.__classifier_threshold, 
-                                                self.__classifier_transform)
-                classes = results.argmax(dim=1) # выбираем классы для всех людей
-                rects = rects_ # ПОДМЕНА НА НАШИ РАМКИ
-                for i in range(len(rects)):
-                    class_id = classes[i]
-                    conf = results[i][class_id]
-                    if conf > self.__classifier_threshold:
-                        img = drawRectangle(img, 
-                                            *rects[i], 
-                                            rect_color=self.rect_colors[class_id],
-                                            title=f'ID:{i} | {self.names_of_classes[class_id]}: {conf:.2f}')
-                    else:
-                        img = drawRectangle(img, *rects[i], rect_color=self.rect_colors[-1],
-                                            title=f'ID:{i} | {self.names_of_classes[-1]}: {conf:.2f}')
-                self.__output['frame'] = img
-                self.__output['classes'] = classes
-                self.__output['bboxes'] = rects
-            else:
-                self.__output['frame'] = img
-                self.__output['classes'] = None
-                self.__output['bboxes'] = None
-                self.tr.resetPrevPersonsCount() # если в кадре нет людей, то обнуляем число отслеживаемых людей
-            self.tr.timeStep()
-            #print('FPS', 1/(time()-start)) 
\ No newline at end of file
+            packet = self.takeFrame()
+            if packet is None:
+                break
+            self.__processPacket(packet)
+
+    def __runPipelined(self):
+        # сам поток Main выступает источником кадров для первой стадии
+        self.__queues = {name: StageQueue(self.__queue_depth, self.__drop_policy) for name, _ in self.__stages}
+        queues = list(self.__queues.values()) + [None]
+        # упавшая стадия останавливает Main: takeFrame вернет None, ждущие waitOutput проснутся
+        stages = [Stage(f'{self.name}-{name}', stage, queues[i], queues[i+1], on_error=lambda _: self.stop()) 
+                  for i, (name, stage) in enumerate(self.__stages)]
+        for stage in stages:
+            stage.start()
+        try:
+            while self.__is_alive:
+                packet = self.takeFrame()
+                if packet is None:
+                    break
+                self.__queues['pose'].put(packet)
+        finally:
+            self.__queues['pose'].close() # стадии завершатся по цепочке
+            for stage in stages:
+                stage.join()
+        for stage in stages:
+            if stage.error is not None:
+                raise RuntimeError(f'Pipeline stage {stage.name} failed') from stage.error
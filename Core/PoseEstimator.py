@@ -1,29 +1,147 @@
+import os
 from ultralytics import YOLO
 import torch
+import numpy as np
 from Core.utilities import config as cfg # Импортируем конфиг
 
 
+# backend -> (формат экспорта ultralytics, суффикс артефакта рядом с весами)
+EXPORT_BACKENDS = {'onnx': ('onnx', '.onnx'),
+                   'openvino': ('openvino', '_openvino_model'),
+                   'onnx_int8': ('onnx', '_int8.onnx')} # делается калибровкой в Core.utilities.quantize
+
+
+def getExportedPath(weights, backend):
+    export_format, suffix = EXPORT_BACKENDS[backend]
+    return os.path.splitext(weights)[0] + suffix
+
+
+def exportModel(weights, backend):
+    '''Экспортирует .pt в формат backend один раз и возвращает путь к артефакту.
+    Вход динамический, чтобы работали батчи и смена imgsz лестницей деградации'''
+    path = getExportedPath(weights, backend)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(weights):
+        return path
+    if backend == 'onnx_int8':
+        raise FileNotFoundError(f'No up-to-date INT8 model at {path}, run: python -m Core.utilities.quantize')
+    export_format, _ = EXPORT_BACKENDS[backend]
+    print(f"Exporting YOLO model '{weights}' to {export_format}...")
+    exported = YOLO(weights).export(format=export_format, dynamic=True, imgsz=cfg.POSE_IMGSZ, device='cpu')
+    if os.path.abspath(exported) != os.path.abspath(path): # ultralytics кладет артефакт рядом с весами
+        os.replace(exported, path)
+    return path
+
+
+
+def stackPoses(outputs):
+    '''Собирает список результатов processFrame в формат processFrames: точки и рамки дополняются нулями'''
+    counts = np.array([len(keypoints) if keypoints.size else 0 for _, keypoints, _ in outputs], dtype=np.int32)
+    persons_count = max(counts, default=0)
+    keypoints = np.zeros((len(outputs), persons_count, cfg.BODY_POINTS_NUM, 3), dtype=np.float32)
+    boxes = np.zeros((len(outputs), persons_count, 4), dtype=np.float32)
+    for i, (_, kps, bxs) in enumerate(outputs):
+        keypoints[i, :counts[i]] = kps[:counts[i]]
+        boxes[i, :counts[i]] = bxs[:counts[i]]
+    return [image for image, _, _ in outputs], keypoints, boxes, counts
+
+
 
 class PoseEstimator():
-    def __init__(self, net =cfg.YOLO_MODEL_PATH):        
-        self.net = YOLO(net)
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        print(f"PoseEstimator using device: {self.device}") # Добавим лог
-        
-        try:
-             self.net.to(self.device)
-             print(f"YOLO model '{net}' loaded successfully on {self.device}")
-        except Exception as e:
-             print(f"Error moving YOLO model to {self.device}: {e}")
-             raise # Перевыбрасываем ошибку, чтобы увидеть ее выше
-        
+    def __init__(self, net =cfg.YOLO_MODEL_PATH, imgsz=cfg.POSE_IMGSZ, backend=cfg.POSE_BACKEND, warmup=cfg.POSE_WARMUP):
+        if backend != 'torch' and backend not in EXPORT_BACKENDS:
+            raise ValueError(f'Unknown pose backend: {backend}')
+        self.backend = backend
+        self.imgsz = imgsz
+        # выходные буферы пакетного API, растут по мере надобности и переиспользуются между вызовами
+        self.__batch_keypoints = np.zeros((0, 0, cfg.BODY_POINTS_NUM, 3), dtype=np.float32)
+        self.__batch_boxes = np.zeros((0, 0, 4), dtype=np.float32)
+        self.__batch_counts = np.zeros(0, dtype=np.int32)
+        if backend == 'torch':
+            self.net = YOLO(net)
+            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            print(f"PoseEstimator using device: {self.device}") # Добавим лог
+
+            try:
+                 self.net.to(self.device)
+                 print(f"YOLO model '{net}' loaded successfully on {self.device}")
+            except Exception as e:
+                 print(f"Error moving YOLO model to {self.device}: {e}")
+                 raise # Перевыбрасываем ошибку, чтобы увидеть ее выше
+        else:
+            # экспортированные модели исполняются своим рантаймом на CPU, .to() к ним не применим
+            path = net if not net.endswith('.pt') else exportModel(net, backend)
+            self.net = YOLO(path, task='pose')
+            self.device = torch.device('cpu')
+            print(f"YOLO model '{path}' loaded with {backend} backend")
+
+        if warmup:
+            self.warmup()
+
+
+    def warmup(self, runs=2):
+        frame = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for _ in range(runs):
+            self.processFrame(frame, render=False)
+
 
     def to(self, device):
-        self.net.to(device)
+        if self.backend == 'torch':
+            self.net.to(device)
+
+
+    def setInputSize(self, imgsz):
+        self.imgsz = imgsz
 
     
-    def processFrame(self, frame):
-        result = self.net([frame], verbose = False)
-        return (result[0].plot(boxes=False, probs=False, labels=False), 
-                result[0].keypoints.data.cpu().numpy(), 
-                result[0].boxes.data.cpu().numpy()[:,:4])
+    def processFrame(self, frame, render=True):
+        result = self.net([frame], imgsz=self.imgsz, verbose = False)
+        return self.unpackResult(result[0], render)
+
+
+    def __reserve(self, batch_size, persons_count):
+        capacity, persons_capacity = self.__batch_keypoints.shape[:2]
+        if batch_size <= capacity and persons_count <= persons_capacity:
+            return
+        # растем с запасом, чтобы не перевыделять память на каждом новом максимуме
+        capacity = max(batch_size, 2*capacity)
+        persons_capacity = max(persons_count, 2*persons_capacity)
+        self.__batch_keypoints = np.zeros((capacity, persons_capacity, cfg.BODY_POINTS_NUM, 3), dtype=np.float32)
+        self.__batch_boxes = np.zeros((capacity, persons_capacity, 4), dtype=np.float32)
+        self.__batch_counts = np.zeros(capacity, dtype=np.int32)
+
+
+    def processFrames(self, frames, render=False):
+        '''Пакетная обработка списка кадров или массива (B, H, W, 3).
+        Возвращает (картинки или None, keypoints (B, P, 17, 3), boxes (B, P, 4), counts (B,)),
+        где у i-го кадра валидны первые counts[i] людей. Массивы - срезы внутренних буферов,
+        они перезаписываются следующим вызовом. render может быть флагом на весь батч или списком'''
+        # вход ultralytics готовит сам (letterbox в свои массивы). Готовый тензор он не letterbox-ит,
+        # рамки остаются в его координатах, а plot и постобработка все равно копируют батч в numpy
+        frames = list(frames) # у массива (B, H, W, 3) берутся представления кадров без копирования
+        batch_size = len(frames)
+        results = self.net(frames, imgsz=self.imgsz, verbose = False)
+        renders = render if isinstance(render, (list, tuple)) else [render] * batch_size
+
+        keypoints = [result.keypoints.data for result in results]
+        counts = [len(kps) if kps.numel() else 0 for kps in keypoints] # пустой результат бывает формы (1, 0, 51)
+        self.__reserve(batch_size, max(counts, default=0))
+        images = []
+        for i, (result, count) in enumerate(zip(results, counts)):
+            self.__batch_counts[i] = count
+            if count:
+                self.__batch_keypoints[i, :count] = keypoints[i].cpu().numpy()
+                self.__batch_boxes[i, :count] = result.boxes.data[:, :4].cpu().numpy()
+            images.append(result.plot(boxes=False, probs=False, labels=False) if renders[i] else None)
+        return (images, 
+                self.__batch_keypoints[:batch_size], 
+                self.__batch_boxes[:batch_size], 
+                self.__batch_counts[:batch_size])
+
+
+    def unpackResult(self, result, render=True):
+        # без отрисовки не копируем кадр и не рисуем скелеты, вместо картинки None
+        # float32 при любом backend, как у torch-модели, этого ждут Tracker и numba-ядра
+        return (result.plot(boxes=False, probs=False, labels=False) if render else None, 
+                result.keypoints.data.cpu().numpy().astype(np.float32, copy=False), 
+                result.boxes.data.cpu().numpy()[:,:4].astype(np.float32, copy=False))
+
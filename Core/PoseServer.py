@@ -0,0 +1,49 @@
+from .PoseEstimator import PoseEstimator, stackPoses
+from .utilities.batching import BatchServer
+from Core.utilities import config as cfg
+
+
+class PoseClient():
+    '''Заменяет PoseEstimator внутри Main: кадр уходит в общий батч сервера'''
+    def __init__(self, server, stream_id=None):
+        self.server = server
+        self.stream_id = stream_id
+        self.imgsz = server.pe.imgsz
+
+    def setInputSize(self, imgsz):
+        self.imgsz = imgsz
+
+    def processFrame(self, frame, render=True):
+        return self.server.submit((frame, render, self.imgsz)).wait()
+
+    def processFrames(self, frames, render=False):
+        renders = render if isinstance(render, (list, tuple)) else [render] * len(frames)
+        # все заявки отправляются сразу, чтобы попасть в один батч сервера
+        requests = [self.server.submit((frame, render, self.imgsz)) for frame, render in zip(frames, renders)]
+        return stackPoses([request.wait() for request in requests])
+
+
+class PoseServer(BatchServer):
+    '''Одна модель YOLO на все камеры: кадры разных потоков собираются в один батч'''
+    def __init__(self, 
+                 net=cfg.YOLO_MODEL_PATH,
+                 max_batch_size=cfg.POSE_SERVER_MAX_BATCH,
+                 max_wait=cfg.POSE_SERVER_MAX_WAIT,
+                 pose_estimator=None):
+        BatchServer.__init__(self, max_batch_size=max_batch_size, max_wait=max_wait)
+        self.pe = pose_estimator if pose_estimator is not None else PoseEstimator(net)
+
+    def getClient(self, stream_id=None):
+        return PoseClient(self, stream_id)
+
+    def processBatch(self, payloads):
+        outputs = [None] * len(payloads)
+        # потоки на разных уровнях деградации просят разный размер входа, такие кадры идут отдельными батчами
+        for imgsz in set(payload[2] for payload in payloads):
+            indices = [i for i, payload in enumerate(payloads) if payload[2] == imgsz]
+            self.pe.setInputSize(imgsz)
+            images, keypoints, boxes, counts = self.pe.processFrames([payloads[i][0] for i in indices],
+                                                                     [payloads[i][1] for i in indices])
+            for j, i in enumerate(indices): # буферы переиспользуются, поэтому потокам отдаем копии
+                outputs[i] = (images[j], keypoints[j, :counts[j]].copy(), boxes[j, :counts[j]].copy())
+        return outputs
@@ -0,0 +1,262 @@
+'''
+Супервизор: по процессу на камеру (или на группу камер), чтобы обойти GIL.
+Формат конфига (JSON):
+{
+    "restart_delay": 2,
+    "heartbeat_timeout": 15,
+    "startup_timeout": 120,
+    "threads_per_worker": 1,
+    "pose_backend": "onnx",
+    "cameras": [
+        {"name": "hall", "source": "rtsp://...", "group": "first_floor",
+         "zones": {"regions": [[0, 200, 960, 520], [[1000, 300], [1280, 300], [1280, 720]]], "scale": 0.75}},
+        {"name": "exit", "source": "__Inputs/check.mp4"}
+    ]
+}
+Камеры с одинаковым group обслуживаются одним процессом, без group - каждая своим.
+zones - необязательные зоны интереса: прямоугольники [x, y, w, h] или многоугольники, в YOLO уходят только они.
+Необязательный zones.frame_size [ширина, высота] проверяет зоны при запуске, иначе зона за краем кадра - ошибка на первом кадре.
+pose_backend необязателен (по умолчанию cfg.POSE_BACKEND), экспорт модели делается один раз до запуска процессов.
+'''
+import sys
+import json
+import queue
+import argparse
+import multiprocessing as mp
+from time import time, sleep
+from threading import Thread
+import Core.utilities.config as cfg
+
+
+def loadConfig(path):
+    with open(path, encoding='utf-8') as file:
+        config = json.load(file)
+    groups = {}
+    for camera in config['cameras']:
+        groups.setdefault(camera.get('group', camera['name']), []).append(camera)
+    config['groups'] = groups
+    return config
+
+
+def _readLoop(camera, model, state):
+    import cv2
+    cap = cv2.VideoCapture(camera['source'])
+    try:
+        while state['is_running'] and cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            model.setFrame(frame)
+        if state['is_running'] and camera['source'].lower().startswith('rtsp://'):
+            state['failed'].append(camera['name']) # поток камеры не должен заканчиваться сам
+    finally:
+        cap.release()
+        state['finished'].append(camera['name'])
+
+
+def cameraWorker(group_name, cameras, messages, main_params, threads_per_worker):
+    '''Точка входа процесса: свой Main на каждую камеру группы, результаты и пульс в messages'''
+    import cv2
+    import torch
+    import numba
+    # процессов несколько, поэтому внутренние пулы потоков сжимаем, чтобы не драться за ядра
+    cv2.setNumThreads(threads_per_worker)
+    torch.set_num_threads(threads_per_worker)
+    numba.set_num_threads(min(threads_per_worker, numba.config.NUMBA_NUM_THREADS))
+    from Core.Main import Main
+
+    state = {'is_running': True, 'finished': [], 'failed': []}
+    models, readers = {}, []
+    try:
+        for camera in cameras:
+            model = Main(**main_params, zones=camera.get('zones'))
+            model.start()
+            models[camera['name']] = model
+            reader = Thread(target=_readLoop, args=(camera, model, state), daemon=True)
+            reader.start()
+            readers.append(reader)
+
+        last_ids = {name: 0 for name in models}
+        last_health = start = time()
+        while len(state['finished']) < len(cameras):
+            if state['failed']: # процесс упадет и супервизор перезапустит группу
+                raise RuntimeError(f'Lost video source: {state["failed"]}')
+            for name, model in models.items():
+                output = model.getOutput() # неизменяемый снимок, читать можно без блокировок
+                if output.frame_id == last_ids[name]:
+                    continue
+                last_ids[name] = output.frame_id
+                messages.put(('result', group_name, name, {
+                    'frame_id': output.frame_id,
+                    'capture_time': output.capture_time,
+                    'classes': list(output.classes) if output.classes is not None else None,
+                    'bboxes': [list(rect) for rect in output.bboxes] if output.bboxes is not None else None,
+                    'track_ids': list(output.track_ids) if output.track_ids is not None else None,
+                }))
+            now = time()
+            if now - last_health >= 1.:
+                messages.put(('health', group_name, None, {
+                    'time': now,
+                    'fps': {name: model.getProcessedCount() / (now - start) for name, model in models.items()},
+                    'dropped': {name: model.getDroppedCount() for name, model in models.items()},
+                    # по ним супервизор видит зависшие камеры: пульс идет, а обработанных кадров не прибавляется
+                    'processed': {name: model.getProcessedCount() for name, model in models.items()},
+                    'finished': list(state['finished']),
+                }))
+                last_health = now
+            sleep(0.005)
+        messages.put(('finished', group_name, None, {}))
+    except Exception as e:
+        messages.put(('error', group_name, None, {'error': repr(e)}))
+        raise
+    finally:
+        state['is_running'] = False
+        for model in models.values():
+            model.stop()
+            model.join(timeout=2.)
+
+
+class Supervisor():
+    def __init__(self, config, main_params=None, on_message=None):
+        self.config = config
+        self.main_params = main_params or {'max_persons_count': cfg.MAX_PERSON_COUNT,
+                                           'names_of_classes': cfg.CLASSES,
+                                           'frame_steps': cfg.SEQ_LENGTH,
+                                           'classifier_neurons': cfg.CLASSIFIER_NEURONS}
+        self.on_message = on_message
+        self.restart_delay = config.get('restart_delay', cfg.SUPERVISOR_RESTART_DELAY)
+        self.heartbeat_timeout = config.get('heartbeat_timeout', cfg.SUPERVISOR_HEARTBEAT_TIMEOUT)
+        self.startup_timeout = config.get('startup_timeout', cfg.SUPERVISOR_STARTUP_TIMEOUT)
+        self.threads_per_worker = config.get('threads_per_worker', cfg.SUPERVISOR_THREADS_PER_WORKER)
+        self.pose_backend = config.get('pose_backend', cfg.POSE_BACKEND)
+        if self.pose_backend != 'torch':
+            from Core.PoseEstimator import exportModel
+            params = dict(self.main_params.get('pose_estimator_params') or {})
+            # экспортируем здесь, иначе процессы начнут писать один и тот же файл одновременно
+            params['net'] = exportModel(params.get('net', cfg.YOLO_MODEL_PATH), self.pose_backend)
+            params['backend'] = self.pose_backend
+            self.main_params = dict(self.main_params, pose_estimator_params=params)
+        self.__ctx = mp.get_context('spawn') # fork + torch/numba в потоках ведет к зависаниям
+        self.__messages = self.__ctx.Queue()
+        self.__workers = {} # group -> процесс
+        self.__progress = {} # group -> {камера: [обработано кадров, когда число последний раз росло]}
+        self.__restart_at = {} # group -> когда перезапускать упавший процесс
+        self.__started = set() # группы, приславшие хотя бы одно сообщение после запуска
+        self.__finished = set()
+        self.restarts = {group: 0 for group in config['groups']}
+        self.health = {}
+        self.__is_alive = False
+
+    def __spawn(self, group):
+        process = self.__ctx.Process(target=cameraWorker,
+                                     name=f'camera-worker-{group}',
+                                     args=(group, self.config['groups'][group], self.__messages,
+                                           self.main_params, self.threads_per_worker),
+                                     daemon=True)
+        process.start()
+        self.__workers[group] = process
+        self.__started.discard(group)
+        now = time()
+        self.__progress[group] = {camera['name']: [0, now] for camera in self.config['groups'][group]}
+
+    def __handle(self, message):
+        kind, group, camera, payload = message
+        now = time()
+        progress = self.__progress[group]
+        if group not in self.__started: # загрузка моделей позади, отсчет прогресса камер с этого момента
+            self.__started.add(group)
+            for entry in progress.values():
+                entry[1] = now
+        if kind == 'health':
+            self.health[group] = payload
+            for name, count in payload['processed'].items():
+                if name in progress and count > progress[name][0]:
+                    progress[name][:] = [count, now]
+            for name in payload['finished']: # источник закончился штатно, кадров больше не будет
+                progress.pop(name, None)
+        elif kind == 'result' and camera in progress:
+            progress[camera][1] = now
+        elif kind == 'finished':
+            self.__finished.add(group)
+        elif kind == 'error':
+            print(f'Worker {group} failed: {payload["error"]}')
+        if self.on_message:
+            self.on_message(kind, group, camera, payload)
+
+    def __checkWorkers(self):
+        now = time()
+        for group, process in list(self.__workers.items()):
+            if group in self.__finished:
+                continue
+            if group in self.__restart_at: # не спим здесь, иначе встанет разбор сообщений остальных групп
+                if now >= self.__restart_at[group]:
+                    del self.__restart_at[group]
+                    self.restarts[group] += 1
+                    self.__spawn(group)
+                continue
+            # до первого сообщения процесс грузит модели и компилирует numba, ждем дольше
+            timeout = self.heartbeat_timeout if group in self.__started else self.startup_timeout
+            # живой процесс с пульсом еще не здоров: каждая его камера должна обрабатывать кадры
+            stalled = [name for name, (_, seen) in self.__progress[group].items() if now - seen >= timeout]
+            if process.is_alive() and not stalled:
+                continue
+            if process.is_alive(): # завис
+                print(f'Worker {group}: no processed frames from {stalled} for {timeout}s, killing it')
+                process.terminate()
+            process.join(timeout=1.)
+            if process.exitcode == 0: # все источники группы закончились штатно
+                self.__finished.add(group)
+                continue
+            print(f'Worker {group} exited with code {process.exitcode}, restarting in {self.restart_delay}s')
+            self.__restart_at[group] = now + self.restart_delay
+
+    def getAggregateFPS(self):
+        return sum(sum(health['fps'].values()) for health in self.health.values())
+
+    def run(self):
+        self.__is_alive = True
+        for group in self.config['groups']:
+            self.__spawn(group)
+        try:
+            while self.__is_alive and len(self.__finished) < len(self.__workers):
+                try:
+                    self.__handle(self.__messages.get(timeout=0.5))
+                    while True: # разбираем все накопившееся
+                        self.__handle(self.__messages.get_nowait())
+                except queue.Empty:
+                    pass
+                self.__checkWorkers()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.__is_alive = False
+
+    def shutdown(self):
+        for process in self.__workers.values():
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=2.)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Chii supervisor')
+    parser.add_argument('config', help='JSON config with cameras')
+    args = parser.parse_args()
+
+    def printMessage(kind, group, camera, payload):
+        if kind == 'health':
+            print(f'[{group}] fps: {payload["fps"]} dropped: {payload["dropped"]}')
+        elif kind == 'result' and payload['classes']:
+            print(f'[{group}/{camera}] frame {payload["frame_id"]}: {payload["classes"]}')
+
+    supervisor = Supervisor(loadConfig(args.config), on_message=printMessage)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        print('Keyboard exception caught!\nExiting...')
+    print(f'Aggregate FPS: {supervisor.getAggregateFPS():.2f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,42 +1,158 @@
 import numpy as np
-from .utilities.fast_tools import fast_distribute
+from .utilities.fast_tools import fast_associate, fast_normalize_newest, fast_normalize_pack
+from .utilities import config as cfg
+from .utilities.tools import resized
+
+
 class Tracker:
-    def __init__(self, max_persons_count, frame_steps, track_limb, human_shape):
-        self.__slots = np.zeros((max_persons_count, frame_steps) + human_shape, dtype=np.float32)        
+    def __init__(self, max_persons_count, frame_steps, track_limb, human_shape, 
+                 max_distance=cfg.TRACK_MAX_DISTANCE, max_misses=cfg.TRACK_MAX_MISSES,
+                 slots_chunk=cfg.TRACK_SLOTS_CHUNK):
+        # слоты выделяются кусками по slots_chunk по мере надобности, max_persons_count - жесткий потолок
+        self.__max_capacity = max_persons_count
+        self.__slots_chunk = slots_chunk
+        self.__demand = 0 # живые треки + кандидаты на последнем кадре: столько слотов может понадобиться
+        capacity = min(slots_chunk, max_persons_count)
+        self.__slots = np.zeros((capacity, frame_steps) + human_shape, dtype=np.float32)        
         self.__track_limb = np.uint8(track_limb)
+        self.__max_distance = np.float32(max_distance) # дальше этого кандидат начинает новый трек
+        self.__max_misses = max_misses # после стольких кадров подряд без детекции трек удаляется
 
-        # быстрее обращаться по ссылкам на срезы, чем брать срезы при помощи литералов на месте
-        self.__no_last_frame = self.__slots[:, :frame_steps-1]
-        
-        if frame_steps > 1: # если кадров 2+, то можно взять часть без первого кадра
-            self.__pre_last_frame_idx = np.uint16(frame_steps-2)
-            self.__no_first_frame = self.__slots[:, 1:] # разделение
-        else: # если кадр 1, то нельзя
-            self.__pre_last_frame_idx = np.uint16(0)
-            self.__no_first_frame = self.__no_last_frame
+        # кольцевой буфер по времени: самый новый кадр лежит на позиции head, шаг времени - сдвиг head
+        self.__frame_steps = frame_steps
+        self.__head = frame_steps - 1
+        # нормализованные кадры в том же кольце: на каждом шаге считается только новый кадр
+        self.__normalized = np.zeros_like(self.__slots)
+        self.__rects = np.zeros((capacity, 4), dtype=np.float32) # рамки людей на новом кадре
+        self.__prev_max_persons_count = np.array([0], dtype=np.int64) # число живых треков, они всегда лежат в начале слотов
         
-        self.__last_frame = self.__slots[:, -1]       
-        self.__prev_max_persons_count = np.array([0]) # для возможности менять значение по ссылке
-        
-        self.__global_mtrx = np.full((max_persons_count, max_persons_count), fill_value=np.inf, dtype=np.float32)
+        self.__global_mtrx = np.full((capacity, capacity), fill_value=np.inf, dtype=np.float32)
+
+        # жизненный цикл треков
+        self.__anchors = np.zeros((capacity, 2, human_shape[1]), dtype=np.float32) # где ждем трек на этом кадре
+        self.__slot_state = np.zeros(capacity, dtype=np.int8) # 0 - не найден, 1 - продолжен, 2 - новый
+        self.__track_ids = np.zeros(capacity, dtype=np.int64)
+        self.__ages = np.zeros(capacity, dtype=np.int32) # кадров с появления трека
+        self.__misses = np.zeros(capacity, dtype=np.int32) # кадров подряд без детекции
+        self.__next_track_id = 1
+
+        # предсказание движения: состояние (cx, cy, vx, vy) и ковариация на каждый слот
+        self.__states = np.zeros((capacity, 4), dtype=np.float32)
+        self.__covariances = np.zeros((capacity, 4, 4), dtype=np.float32)
+        self.__last_seen = np.zeros((capacity,) + human_shape, dtype=np.float32) # последний найденный скелет
+        self.__last_centers = np.zeros((capacity, 2), dtype=np.float32) # и его центр
+        self.__kalman_params = (np.float32(cfg.KALMAN_PROCESS_NOISE), 
+                                np.float32(cfg.KALMAN_MEASUREMENT_NOISE),
+                                np.float32(cfg.KALMAN_INITIAL_VARIANCE))
         
     # значительно быстрее через numba.njit
     def distribute(self, new_humans): 
-        fast_distribute(new_humans, self.__slots, self.__global_mtrx, 
-                        self.__pre_last_frame_idx, self.__prev_max_persons_count, self.__track_limb)
+        self.__associate(new_humans)
+        self.__normalized[np.flatnonzero(self.__slot_state[:self.__prev_max_persons_count[0]] == 2)] = 0.
+        self.__updateLifecycle()
+
+
+    def step(self, new_humans, output):
+        '''distribute + normalize без промежуточных копий: окна живых треков от старого кадра к новому
+        пишутся прямо в output (непрерывный float32 буфер классификатора). Возвращает (рамки, окна)'''
+        if len(output) < self.reserve(len(new_humans)): # ядро пишет без проверки границ
+            raise ValueError(f'Output buffer for {len(output)} persons is smaller than tracker capacity {self.getCapacity()}')
+        self.__associate(new_humans)
+        count = self.__prev_max_persons_count[0]
+        fast_normalize_pack(self.__slots, self.__normalized, self.__head, self.__slot_state, count, 
+                            self.__rects, output)
+        self.__updateLifecycle()
+        return self.__rects[:count].copy(), output[:count]
+
+
+    # значительно быстрее через numba.njit
+    def __associate(self, new_humans):
+        self.reserve(len(new_humans))
+        # сравниваем кандидатов с предсказанным положением треков, а не с прошлым кадром
+        fast_associate(new_humans, self.__slots, self.__head, self.__anchors, self.__global_mtrx, 
+                       self.__prev_max_persons_count, self.__track_limb, self.__max_distance, self.__slot_state, 
+                       self.__states, self.__covariances, self.__last_seen, self.__last_centers, 
+                       *self.__kalman_params)
+
+
+    def __updateLifecycle(self):
+        count = self.__prev_max_persons_count[0]
+        state = self.__slot_state[:count]
+        new = np.flatnonzero(state == 2)
+        if len(new):
+            self.__track_ids[new] = np.arange(self.__next_track_id, self.__next_track_id + len(new))
+            self.__next_track_id += len(new)
+            self.__ages[new] = 0
+        self.__ages[:count] += 1
+        self.__misses[:count] = np.where(state > 0, 0, self.__misses[:count] + 1)
         
-    # через numpy быстрее, чем через numba.njit (особенно при увеличении размера) 
+    def reserve(self, candidates_count):
+        '''Добирает слоты кусками: большинство кандидатов продолжают живые треки, поэтому хватает
+        большего из двух чисел и куска запаса на новых людей. Если новых больше запаса, лишние
+        отбрасываются на один кадр, а на следующем емкость уже вырастет.
+        Возвращает текущую емкость - по ней вызывающий подстраивает свои буферы на слот'''
+        self.__demand = max(self.__prev_max_persons_count[0], candidates_count) + self.__slots_chunk
+        capacity = self.__capacityFor(self.__demand) # у потолка может не вырасти
+        if capacity > self.getCapacity():
+            self.__resize(capacity)
+        return self.getCapacity()
+
+
+    def __capacityFor(self, count):
+        chunks = max(1, -(-count // self.__slots_chunk))
+        return min(chunks * self.__slots_chunk, self.__max_capacity)
+
+
+    def __shrink(self):
+        # с запасом в кусок и только когда лишних хотя бы два куска, чтобы не дергаться туда-обратно
+        target = self.__capacityFor(self.__demand)
+        if self.getCapacity() >= target + 2 * self.__slots_chunk:
+            self.__resize(min(target + self.__slots_chunk, self.__max_capacity))
+
+
+    def __resize(self, capacity):
+        count = self.__prev_max_persons_count[0]
+        self.__slots = resized(self.__slots, capacity, count)
+        self.__normalized = resized(self.__normalized, capacity, count)
+        self.__rects = resized(self.__rects, capacity, count)
+        self.__anchors = resized(self.__anchors, capacity, count)
+        self.__slot_state = resized(self.__slot_state, capacity, count)
+        self.__track_ids = resized(self.__track_ids, capacity, count)
+        self.__ages = resized(self.__ages, capacity, count)
+        self.__misses = resized(self.__misses, capacity, count)
+        self.__states = resized(self.__states, capacity, count)
+        self.__covariances = resized(self.__covariances, capacity, count)
+        self.__last_seen = resized(self.__last_seen, capacity, count)
+        self.__last_centers = resized(self.__last_centers, capacity, count)
+        self.__global_mtrx = np.full((capacity, capacity), fill_value=np.inf, dtype=np.float32) # заполняется каждый кадр
+
+
     def timeStep(self):
-        # выполняем смещение кадров во времени
-        # переносим 2 последних кадра на первые 2 позиции
-        self.__no_last_frame[:self.__prev_max_persons_count[0]] = self.__no_first_frame[:self.__prev_max_persons_count[0]] 
-        self.__last_frame[:self.__prev_max_persons_count[0]] = 0. # последний кадр затирем
+        self.__reclaim()
+        self.__shrink()
+        # вместо копирования всей истории сдвигаем голову, самый старый кадр становится новым
+        self.__head = (self.__head + 1) % self.__frame_steps
+        self.__slots[:self.__prev_max_persons_count[0], self.__head] = 0. # новый кадр затирем
+
+
+    def __reclaim(self):
+        '''Удаляет потерянные треки и сдвигает живые в начало, чтобы работа шла только по ним'''
+        count = self.__prev_max_persons_count[0]
+        lost = self.__misses[:count] >= self.__max_misses
+        if not lost.any():
+            return
+        keep = np.flatnonzero(~lost)
+        for array in (self.__slots, self.__normalized, self.__anchors, self.__track_ids, self.__ages, self.__misses,
+                      self.__states, self.__covariances, self.__last_seen, self.__last_centers):
+            array[:len(keep)] = array[keep]
+        self.__prev_max_persons_count[0] = len(keep)
 
 
     def resetState(self):
-        self.__slots[:] = 0.
-        self.__global_mtrx[:] = np.inf
         self.resetPrevPersonsCount()
+        self.__head = self.__frame_steps - 1
+        self.__demand = 0
+        self.__resize(self.__capacityFor(0)) # новые массивы уже нулевые
 
 
     def resetPrevPersonsCount(self):
@@ -44,12 +160,57 @@ class Tracker:
 
 
     def getPersons(self):
+        '''Кольцевой буфер живых треков, кадры по порядку дает fast_personwise_normalize_all c getHead()
+        или getOrderedPersons()'''
         return self.__slots[:self.__prev_max_persons_count[0]]
 
 
+    def getHead(self):
+        return self.__head
+
+
+    def getOrderedPersons(self, output=None):
+        '''Кадры живых треков от старого к новому, одной выборкой в output (если передан)'''
+        return self.__ordered(self.getPersons(), output)
+
+
+    def normalize(self, output=None):
+        '''Нормализует новый кадр живых треков и возвращает (рамки на новом кадре, окна от старого кадра к новому).
+        Окна собираются в output (например, заранее выделенный буфер классификатора)'''
+        count = self.__prev_max_persons_count[0]
+        fast_normalize_newest(self.__slots[:count], self.__normalized[:count], self.__head, self.__rects[:count])
+        return self.__rects[:count].copy(), self.__ordered(self.__normalized[:count], output)
+
+
+    def __ordered(self, ring, output=None):
+        # два непрерывных куска кольца вместо поэлементной выборки
+        if output is None:
+            output = np.empty_like(ring)
+        tail = self.__frame_steps - self.__head - 1
+        output[:, :tail] = ring[:, self.__head+1:]
+        output[:, tail:] = ring[:, :self.__head+1]
+        return output
+
+
     def getPersonsCount(self):
         return self.__prev_max_persons_count[0]
 
 
+    def getTrackIds(self):
+        return self.__track_ids[:self.__prev_max_persons_count[0]]
+
+
+    def getTrackAges(self):
+        return self.__ages[:self.__prev_max_persons_count[0]]
+
+
+    def getTrackMisses(self):
+        return self.__misses[:self.__prev_max_persons_count[0]]
+
+
+    def getCapacity(self):
+        return len(self.__slots)
+
+
     def getSlotsCopy(self):
-        return self.__slots.copy()
\ No newline at end of file
+        return self.__slots.copy()
@@ -1,3 +1,5 @@
 from .Main import *
 from .ActivityClassifier import *
-from .Tracker import *
\ No newline at end of file
+from .Tracker import *
+from .PoseServer import *
+from .ClassifierServer import *
\ No newline at end of file
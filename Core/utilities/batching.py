@@ -0,0 +1,89 @@
+from time import time
+from collections import deque
+from threading import Thread, Condition, Event
+
+
+class BatchRequest:
+    '''Заявка одного потока в общий батч, результат ждется через wait'''
+    def __init__(self, payload):
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.__done = Event()
+
+    def setResult(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.__done.set()
+
+    def wait(self, timeout=None):
+        if not self.__done.wait(timeout):
+            raise TimeoutError('Batch request was not processed in time')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class BatchServer(Thread):
+    '''Копит заявки от разных потоков не дольше max_wait секунд и обрабатывает их одним батчем.
+    Наследники реализуют processBatch(payloads) -> список результатов в том же порядке'''
+    def __init__(self, max_batch_size=8, max_wait=0.01):
+        Thread.__init__(self, daemon=True)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches_count = 0
+        self.items_count = 0
+        self.__requests = deque()
+        self.__cond = Condition()
+        self.__is_alive = True
+
+    def submit(self, payload):
+        request = BatchRequest(payload)
+        with self.__cond:
+            if not self.__is_alive:
+                raise RuntimeError(f'{self.__class__.__name__} is stopped')
+            self.__requests.append(request)
+            self.__cond.notify_all()
+        return request
+
+    def getMeanBatchSize(self):
+        return self.items_count / self.batches_count if self.batches_count else 0.
+
+    def processBatch(self, payloads):
+        raise NotImplementedError
+
+    def stop(self):
+        with self.__cond:
+            self.__is_alive = False
+            self.__cond.notify_all()
+
+    def __collectBatch(self):
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__requests or not self.__is_alive)
+            # дедлайн отсчитывается от первой заявки, чтобы ее задержка была ограничена
+            deadline = time() + self.max_wait
+            while self.__is_alive and len(self.__requests) < self.max_batch_size:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            size = min(len(self.__requests), self.max_batch_size)
+            return [self.__requests.popleft() for _ in range(size)]
+
+    def run(self):
+        while True:
+            batch = self.__collectBatch()
+            if not batch:
+                if not self.__is_alive:
+                    break
+                continue
+            try:
+                results = self.processBatch([request.payload for request in batch])
+            except Exception as e: # ошибку получит каждый ожидающий поток
+                for request in batch:
+                    request.setResult(error=e)
+                continue
+            self.batches_count += 1
+            self.items_count += len(batch)
+            for request, result in zip(batch, results):
+                request.setResult(result)
@@ -0,0 +1,36 @@
+'''
+Сборка AOT-модуля с numba-ядрами трекера, чтобы процессы камер и Flask не компилировали их при старте.
+
+    python -m Core.utilities.build_fast_tools
+
+Рядом с fast_tools.py появляются _fast_tools_aot.*.so/.pyd и штамп с хэшем исходника.
+После правки fast_tools.py штамп перестает совпадать и ядра снова берутся из JIT-кэша, пока модуль не пересобран.
+'''
+import os
+import sys
+import subprocess
+
+
+def main():
+    if os.environ.get('CHII_NUMBA_AOT') != '0':
+        # собирать нужно из исходных функций, поэтому уже загруженный AOT-модуль подменять нельзя
+        env = dict(os.environ, CHII_NUMBA_AOT='0')
+        return subprocess.call([sys.executable, '-m', 'Core.utilities.build_fast_tools'] + sys.argv[1:], env=env)
+
+    from numba import void
+    from numba.pycc import CC
+    from Core.utilities import fast_tools
+
+    cc = CC(fast_tools.AOT_MODULE)
+    cc.output_dir = os.path.dirname(os.path.abspath(fast_tools.__file__))
+    for name in fast_tools.AOT_KERNELS:
+        cc.export(name, void(*fast_tools.SIGNATURES[name]))(getattr(fast_tools, name).py_func)
+    cc.compile()
+    with open(fast_tools.AOT_STAMP, 'w', encoding='utf-8') as file:
+        file.write(fast_tools.getSourceHash())
+    print(f'Built {fast_tools.AOT_MODULE} in {cc.output_dir}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import torch
+import numpy as np
+import Core.utilities.config as cfg
+from Core.utilities.tools import resized
+
+
+class ClassificationCache:
+    '''Кэш вероятностей классов по слотам трекера: человек переклассифицируется раз в cadence кадров
+    или раньше, если его нормализованный скелет сдвинулся больше motion_threshold с прошлой классификации'''
+    def __init__(self, max_persons_count, num_of_classes,
+                 human_shape=(cfg.BODY_POINTS_NUM, cfg.BODY_POINTS_DIM),
+                 cadence=cfg.CLASSIFIER_CADENCE,
+                 motion_threshold=cfg.CLASSIFIER_MOTION_THRESHOLD):
+        self.cadence = cadence
+        self.motion_threshold = motion_threshold
+        self.__probs = torch.zeros((max_persons_count, num_of_classes))
+        self.__keypoints = np.zeros((max_persons_count,) + human_shape, dtype=np.float32) # последний кадр на момент классификации
+        self.__age = np.zeros(max_persons_count, dtype=np.int32) # кадров с последней классификации
+        self.__valid = np.zeros(max_persons_count, dtype=np.bool_)
+        self.__track_ids = np.zeros(max_persons_count, dtype=np.int64) # чей результат лежит в слоте
+        self.calls = 0 # сколько людей реально прогнано через классификатор
+        self.hits = 0 # сколько раз взяли готовый результат
+
+    def reset(self):
+        self.__valid[:] = False
+
+    def getCapacity(self):
+        return len(self.__valid)
+
+    def resize(self, capacity):
+        '''Следует за емкостью трекера, результаты первых слотов сохраняются'''
+        count = min(capacity, self.getCapacity())
+        probs = torch.zeros((capacity, self.__probs.shape[1]))
+        probs[:count] = self.__probs[:count]
+        self.__probs = probs
+        self.__keypoints = resized(self.__keypoints, capacity, count)
+        self.__age = resized(self.__age, capacity, count)
+        self.__valid = resized(self.__valid, capacity, count)
+        self.__track_ids = resized(self.__track_ids, capacity, count)
+
+    def getStale(self, Xs, track_ids=None):
+        '''Индексы людей, которых нужно классифицировать заново.
+        Если трекер перенес в слот другой трек (track_ids не совпал), старый результат не годится'''
+        count = len(Xs)
+        self.__age[:count] += 1
+        motion = np.abs(Xs[:, -1] - self.__keypoints[:count]).mean(axis=(1, 2))
+        stale = ~self.__valid[:count] | (self.__age[:count] >= self.cadence) | (motion > self.motion_threshold)
+        if track_ids is not None:
+            stale |= self.__track_ids[:count] != track_ids
+        indices = np.flatnonzero(stale)
+        self.calls += len(indices)
+        self.hits += count - len(indices)
+        return indices
+
+    def update(self, indices, probs, Xs, track_ids=None):
+        self.__probs[indices] = probs.detach()
+        if track_ids is not None:
+            self.__track_ids[indices] = track_ids[indices]
+        self.__keypoints[indices] = Xs[indices, -1]
+        self.__age[indices] = 0
+        self.__valid[indices] = True
+
+    def getResults(self, count):
+        return self.__probs[:count].clone() # копия, чтобы рисование не видело следующий кадр
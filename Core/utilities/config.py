@@ -13,14 +13,81 @@ INPUTS_DIR = os.path.join(PROJECT_ROOT, '__Inputs')
 BODY_POINTS_NUM = 17
 BODY_POINTS_DIM = 2
 TRACK_LIMB = (11, 12)
+# Брать numba-ядра из AOT-модуля, если он собран (python -m Core.utilities.build_fast_tools); CHII_NUMBA_AOT=0 отключает
+NUMBA_AOT = os.environ.get('CHII_NUMBA_AOT', '1') != '0'
+TRACK_MAX_MISSES = 15 # кадров подряд без детекции, после которых трек удаляется и слот освобождается
+TRACK_SLOTS_CHUNK = 8 # слоты трекера выделяются и освобождаются такими кусками, до MAX_PERSON_COUNT
+TRACK_MAX_DISTANCE = 200 # сумма |dx|+|dy| по точкам TRACK_LIMB в пикселях, дальше - уже другой человек
+# Фильтр Калмана с постоянной скоростью для центра TRACK_LIMB (дисперсии в пикселях^2)
+KALMAN_PROCESS_NOISE = 4.
+KALMAN_MEASUREMENT_NOISE = 16.
+KALMAN_INITIAL_VARIANCE = 400.
 
 CLASSIF_MODEL_FILENAME = 'NS0.03_1_AM15_0.75_Q60_N512_FullyEncodedGura_VL97.0_TR99.84.pt'
 CLASSIF_MODEL = os.path.join(WEIGHTS_DIR, CLASSIF_MODEL_FILENAME)
 
 SEQ_LENGTH = 60
-MAX_PERSON_COUNT = 15
+MAX_PERSON_COUNT = 64 # жесткий потолок людей в кадре, тихие камеры держат слоты только под живые треки
 CLASSES = ['squat', 'walk', 'sit', 'stand', 'unknown']
 CLASSIFIER_NEURONS = 512
+CLASSIFIER_CADENCE = 5 # переклассифицировать человека хотя бы раз в столько кадров (1 - каждый кадр)
+CLASSIFIER_MOTION_THRESHOLD = 0.05 # средний сдвиг нормализованных точек, после которого кэш сбрасывается
+
+# Размер входа YOLO по умолчанию
+POSE_IMGSZ = 640
+# Среда выполнения YOLO: 'torch', 'onnx' (ONNX Runtime), 'openvino' или 'onnx_int8'
+# (квантованная модель из python -m Core.utilities.quantize).
+# Экспортированная модель кэшируется рядом с весами и переэкспортируется, если веса новее
+POSE_BACKEND = 'torch'
+POSE_WARMUP = True # прогнать пустой кадр при старте, чтобы первый настоящий кадр не ждал инициализации
+
+# Полная детекция раз в N кадров, между ними YOLO только на вырезках вокруг отслеживаемых людей
+POSE_DETECT_INTERVAL = 1 # 1 - полная детекция на каждом кадре
+POSE_CROP_MARGIN = 0.25 # расширение рамки человека в долях ее ширины/высоты с каждой стороны
+POSE_CROP_IMGSZ = 256 # вход YOLO для вырезок, кратен 32
+
+# Пропуск YOLO на статичных кадрах без отслеживаемых людей (MotionGate)
+MOTION_GATE_WIDTH = 160 # ширина уменьшенного серого кадра
+MOTION_GATE_PIXEL_THRESHOLD = 25 # изменение яркости пикселя, которое считается движением
+MOTION_GATE_AREA_THRESHOLD = 0.002 # доля изменившихся пикселей для срабатывания
+MOTION_GATE_REFRESH_INTERVAL = 2.0 # секунды, через которые кадр анализируется без движения
+
+# Планировщик частоты анализа и лестница деградации при перегрузке
+ANALYSIS_FPS = 15 # целевая частота анализа одного потока
+# max_persons в долях MAX_PERSON_COUNT: слоты трекера растут по живым трекам, верхние ступени не режут толпу
+DEGRADATION_LADDER = (
+    {'fps_scale': 1.0, 'imgsz': 640, 'max_persons': MAX_PERSON_COUNT},
+    {'fps_scale': 0.67, 'imgsz': 640, 'max_persons': MAX_PERSON_COUNT},
+    {'fps_scale': 0.67, 'imgsz': 480, 'max_persons': MAX_PERSON_COUNT * 2 // 3},
+    {'fps_scale': 0.33, 'imgsz': 320, 'max_persons': MAX_PERSON_COUNT // 3},
+)
+SCHEDULER_OVERLOAD_RATIO = 1.0
+SCHEDULER_RECOVER_RATIO = 0.6
+SCHEDULER_PATIENCE = 30 # кадров подряд до смены уровня
+SCHEDULER_SMOOTHING = 0.1
+
+# Конвейерный режим Main
+PIPELINE_QUEUE_DEPTH = 2
+PIPELINE_DROP_POLICY = 'drop_oldest' # 'block', 'drop_oldest' или 'drop_newest'
+
+# Общий сервер позы для нескольких потоков
+POSE_SERVER_MAX_BATCH = 8
+POSE_SERVER_MAX_WAIT = 0.01 # секунды ожидания остальных потоков после первого кадра
+
+# Общий сервер классификатора для нескольких потоков
+CLASSIFIER_SERVER_MAX_BATCH = 16 # число потоков в одном батче
+CLASSIFIER_SERVER_MAX_WAIT = 0.005
+CLASSIFIER_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64) # допустимые размеры батча по людям
+
+# Метрики
+METRICS_WINDOW = 1000 # сколько последних значений держать для перцентилей
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.) # секунды
+
+# Супервизор процессов для нескольких камер
+SUPERVISOR_RESTART_DELAY = 2 # секунды перед перезапуском упавшего процесса
+SUPERVISOR_HEARTBEAT_TIMEOUT = 15 # секунды без сообщений, после которых процесс считается зависшим
+SUPERVISOR_STARTUP_TIMEOUT = 120 # то же, но до первого сообщения (загрузка моделей)
+SUPERVISOR_THREADS_PER_WORKER = 1
 
 # Путь для Chii.py (тоже лучше сделать абсолютным)
 DEFAULT_INPUT_FILENAME = 'check.mp4'
@@ -1,10 +1,69 @@
+import os
 import random
+import hashlib
 import numpy as np
-from numba import njit
-from .config import BODY_POINTS_NUM
+from numba import njit, prange, float32, int64, int8, uint8
+from .config import NUMBA_AOT
 
 
-@njit(fastmath=True)
+# Ядра компилируются один раз по явным сигнатурам и кэшируются на диске (__pycache__), поэтому импорт
+# ничего не JIT-компилирует заново. Если собран AOT-модуль (python -m Core.utilities.build_fast_tools)
+# и он собран из этой версии файла, ядра берутся из него и numba не компилирует их вовсе.
+SIGNATURES = {
+    'fast_personwise_normalize': (float32[:, :],),
+    'fast_personwise_normalize_all': (float32[:, :, :, ::1], float32[:, :, :, ::1], int64),
+    'fast_normalize_newest': (float32[:, :, :, ::1], float32[:, :, :, ::1], int64, float32[:, ::1]),
+    'fast_linear_assignment': (float32[:, :], int64[::1]),
+    'fast_distribute': (float32[:, :, :], float32[:, :, :, ::1], int64, float32[:, :, ::1], float32[:, ::1],
+                        int64[::1], uint8[::1], float32, int8[::1]),
+    'fast_track_center': (float32[:, ::1], uint8[::1]),
+    'fast_kalman_predict': (float32[:, ::1], float32[:, :, ::1], float32[:, :, ::1], float32[:, ::1],
+                            float32[:, :, ::1], int64, uint8[::1], float32),
+    'fast_kalman_correct': (float32[:, :, :, ::1], int64, float32[:, ::1], float32[:, :, ::1], float32[:, :, ::1],
+                            float32[:, ::1], int8[::1], int64, uint8[::1], float32, float32),
+    'fast_normalize_frame': (float32[:, ::1], float32[:, ::1], float32[::1]),
+    'fast_associate': (float32[:, :, :], float32[:, :, :, ::1], int64, float32[:, :, ::1], float32[:, ::1], int64[::1],
+                       uint8[::1], float32, int8[::1], float32[:, ::1], float32[:, :, ::1], float32[:, :, ::1],
+                       float32[:, ::1], float32, float32, float32),
+    'fast_normalize_pack': (float32[:, :, :, ::1], float32[:, :, :, ::1], int64, int8[::1], int64, float32[:, ::1],
+                            float32[:, :, :, ::1]),
+}
+# ничего не возвращают. Параллельные ядра сюда не входят: pycc молча собирает prange как обычный цикл
+AOT_KERNELS = ('fast_linear_assignment', 'fast_distribute', 'fast_kalman_predict', 'fast_kalman_correct',
+               'fast_associate')
+AOT_MODULE = '_fast_tools_aot'
+AOT_STAMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), AOT_MODULE + '.stamp')
+
+
+def getSourceHash():
+    with open(os.path.abspath(__file__), 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def loadAOT():
+    '''AOT-модуль, если он собран из текущей версии исходника, иначе None'''
+    try:
+        with open(AOT_STAMP, encoding='utf-8') as file:
+            if file.read().strip() != getSourceHash():
+                return None
+        from . import _fast_tools_aot
+        return _fast_tools_aot
+    except (OSError, ImportError):
+        return None
+
+
+_aot = loadAOT() if NUMBA_AOT else None
+
+
+def kernel(fastmath=True, parallel=False):
+    def decorator(func):
+        if _aot is not None and hasattr(_aot, func.__name__):
+            return getattr(_aot, func.__name__)
+        return njit([SIGNATURES[func.__name__]], fastmath=fastmath, parallel=parallel, cache=True)(func)
+    return decorator
+
+
+@kernel()
 def fast_personwise_normalize(person):
     person_len = person.shape[0]
     left, top = np.inf, np.inf
@@ -47,13 +106,16 @@ def fast_personwise_normalize(person):
     return (left, top, right, bottom), person    
 
 
-@njit(fastmath=True)
-def fast_personwise_normalize_all(slots, output):
+@kernel()
+def fast_personwise_normalize_all(slots, output, head):
+    '''slots - кольцевой буфер трекера, head - позиция самого нового кадра.
+    В output кадры складываются уже по порядку, от старого к новому'''
     person_len = slots.shape[2]
+    frame_steps = slots.shape[1]
     rects = []
     for k in range(slots.shape[0]):        
-        for j in range(slots.shape[1]):
-            person = slots[k, j]
+        for j in range(frame_steps):
+            person = slots[k, (head + 1 + j) % frame_steps]
             out_person = output[k, j]
             left, top = np.inf, np.inf
             right, bottom = 0, 0
@@ -95,44 +157,273 @@ def fast_personwise_normalize_all(slots, output):
     return rects, output     
 
 
-@njit(fastmath=True)
-def fast_distribute(new_humans, slots, matrix, frame_steps, prev_persons_count, track_limb):    
-    cur_count = max(prev_persons_count[0], new_humans.shape[0]) # если текущих кандидатов больше, то берем их, 
-                                                                # иначе берем максимальное число раннее отслеживаемых людей
-    
-    # формируем матрицу оценок     
-    est_mtrx = matrix[:min((slots.shape[0], cur_count)), # убеждаемся, что число отслеживаемых людей не превысит число слотов
-                      :min(slots.shape[0], new_humans.shape[0])] # аналогично для кандидатов
-    
-    prev_persons_count[0] = cur_count # запоминаем новое максимальное число отслеживаемых людей
-    
-    # заполняем матрицу оценок
-    for i in range(est_mtrx.shape[0]): # перебираем людей в слотах
-        for j in range(est_mtrx.shape[1]): # перебираем кандидатов
-            # slots[i, frame_steps]) - i-й человек с предпоследнего кадра              
-            abs_diff = (np.abs(new_humans[j, track_limb[0]] - slots[i, frame_steps, track_limb[0]]) +
-                        np.abs(new_humans[j, track_limb[1]] - slots[i, frame_steps, track_limb[1]]))
-            est_mtrx[i, j] = abs_diff[0] + abs_diff[1]
-      
-    # выполняем распределение кандидатов на основе их оценок
-    for i in range(min(est_mtrx.shape)): # кол-во слотов или кол-во кандидатов, в зависимости от того, что меньше
-        idx = np.argmin(est_mtrx) # положение глобального минимума в матрице est_mtrx
-        row, col = (idx // est_mtrx.shape[1]), (idx % est_mtrx.shape[1]) # строка и столбец глобального минимума
-        #print(row, col)
-        slots[row, -1] = new_humans[col] # помещаем человека col на последний кадр в слот row
-        est_mtrx[row, :] = np.inf # затираем строку row
-        est_mtrx[:, col] = np.inf # затираем столбец col 
-
-
-# прогрев
-fast_distribute(new_humans=np.zeros((1, BODY_POINTS_NUM, 3), dtype=np.float32)[:, :, :2], 
-                slots=np.zeros((1, 1, BODY_POINTS_NUM, 2), dtype=np.float32, order='C'), 
-                matrix=np.zeros((1, 1), dtype=np.float32, order='C'),
-                frame_steps=np.uint16(1), 
-                prev_persons_count=np.array([1]), 
-                track_limb=np.uint8((1, 8)))
-
-fast_personwise_normalize(person=np.zeros((BODY_POINTS_NUM, 2), dtype=np.float32, order='C'))
-
-fast_personwise_normalize_all(slots=np.zeros((1, 1, BODY_POINTS_NUM, 2), dtype=np.float32, order='C'),
-                              output=np.zeros((1, 1, BODY_POINTS_NUM, 2), dtype=np.float32, order='C'))
\ No newline at end of file
+@kernel()
+def fast_normalize_frame(person, out_person, rect):
+    '''Нормализация одного скелета в out_person, рамка в rect. Без человека - нули'''
+    person_len = person.shape[0]
+    left, top = np.inf, np.inf
+    right, bottom = 0., 0.
+    for i in range(person_len):
+        if person[i, 0] > 0:
+            left = min(left, person[i, 0])
+            right = max(right, person[i, 0])
+        if person[i, 1] > 0:
+            top = min(top, person[i, 1])
+            bottom = max(bottom, person[i, 1])
+
+    if (right == 0 or bottom == 0) or (right == left or bottom == top): # ЛОВИМ ЗЕРОБОЕВ
+        out_person[:] = 0.
+        rect[:] = 0.
+        return
+
+    dx, dy = right-left, bottom-top
+    for i in range(person_len):
+        out_person[i, 0] = max(person[i, 0]-left, 0.) / dx
+        out_person[i, 1] = max(person[i, 1]-top, 0.) / dy
+    rect[0], rect[1], rect[2], rect[3] = left, top, right, bottom
+
+
+@kernel(parallel=True)
+def fast_normalize_newest(slots, normalized, head, rects):
+    '''Нормализует только самый новый кадр (позиция head) каждого трека, параллельно по людям.
+    Остальные кадры normalized уже посчитаны на прошлых шагах'''
+    for k in prange(slots.shape[0]):
+        fast_normalize_frame(slots[k, head], normalized[k, head], rects[k])
+
+
+@kernel(fastmath=False) # сравнения с inf, fastmath их не гарантирует
+def fast_linear_assignment(cost, col4row):
+    '''Оптимальное назначение строк столбцам (кратчайшие увеличивающие пути Jonker-Volgenant, как в
+    scipy.optimize.linear_sum_assignment). Нужно строк <= столбцов, результат - столбец каждой строки в col4row'''
+    n, m = cost.shape
+    u = np.zeros(n)
+    v = np.zeros(m)
+    shortest = np.empty(m)
+    path = np.full(m, -1)
+    row4col = np.full(m, -1)
+    remaining = np.empty(m, dtype=np.int64)
+    SR = np.zeros(n, dtype=np.bool_)
+    SC = np.zeros(m, dtype=np.bool_)
+    col4row[:] = -1
+
+    for cur_row in range(n):
+        # ищем кратчайший увеличивающий путь из cur_row в свободный столбец
+        num_remaining = m
+        for it in range(m):
+            remaining[it] = m - it - 1
+        SR[:] = False
+        SC[:] = False
+        shortest[:] = np.inf
+        min_val = 0.
+        i = cur_row
+        sink = -1
+        while sink == -1:
+            index = -1
+            lowest = np.inf
+            SR[i] = True
+            for it in range(num_remaining):
+                j = remaining[it]
+                r = min_val + cost[i, j] - u[i] - v[j]
+                if r < shortest[j]:
+                    path[j] = i
+                    shortest[j] = r
+                if shortest[j] < lowest or (shortest[j] == lowest and row4col[j] == -1):
+                    lowest = shortest[j]
+                    index = it
+            min_val = lowest
+            j = remaining[index]
+            if row4col[j] == -1:
+                sink = j
+            else:
+                i = row4col[j]
+            SC[j] = True
+            num_remaining -= 1
+            remaining[index] = remaining[num_remaining]
+
+        # обновляем потенциалы
+        u[cur_row] += min_val
+        for i in range(n):
+            if SR[i] and i != cur_row:
+                u[i] += min_val - shortest[col4row[i]]
+        for j in range(m):
+            if SC[j]:
+                v[j] -= min_val - shortest[j]
+
+        # разворачиваем назначения вдоль пути
+        j = sink
+        while True:
+            i = path[j]
+            row4col[j] = i
+            j, col4row[i] = col4row[i], j
+            if i == cur_row:
+                break
+
+
+@kernel()
+def fast_distribute(new_humans, slots, head, anchors, matrix, prev_persons_count, track_limb, max_distance, slot_state):
+    '''Распределяет кандидатов по живым трекам, новый кадр пишется в кольцевой буфер slots на позицию head.
+    anchors - точки track_limb, с которыми сравнивается трек
+    (последнее положение, где его видели). В slot_state пишется 0 - трек не найден, 1 - продолжен, 2 - новый'''
+    live_count = min(prev_persons_count[0], slots.shape[0]) # слоты, в которых уже кто-то отслеживается
+    candidates_count = min(slots.shape[0], new_humans.shape[0]) # лишние кандидаты (YOLO сортирует по уверенности) отбрасываются
+
+    # формируем матрицу оценок, дальше порога все стоят одинаково, чтобы не влиять на остальные пары
+    est_mtrx = matrix[:live_count, :candidates_count]
+    for i in range(live_count): # перебираем людей в слотах
+        for j in range(candidates_count): # перебираем кандидатов
+            abs_diff = (np.abs(new_humans[j, track_limb[0]] - anchors[i, 0]) +
+                        np.abs(new_humans[j, track_limb[1]] - anchors[i, 1]))
+            est_mtrx[i, j] = min(abs_diff[0] + abs_diff[1], max_distance)
+
+    # оптимальное назначение вместо жадного: при пересечении людей жадный алгоритм меняет их местами
+    col4row = np.full(live_count, -1)
+    if live_count and candidates_count:
+        if live_count <= candidates_count:
+            fast_linear_assignment(est_mtrx, col4row)
+        else:
+            row4col = np.empty(candidates_count, dtype=np.int64)
+            fast_linear_assignment(est_mtrx.T, row4col)
+            for j in range(candidates_count):
+                col4row[row4col[j]] = j
+
+    slot_state[:] = 0
+    matched_candidates = np.zeros(candidates_count, dtype=np.bool_)
+    for i in range(live_count):
+        j = col4row[i]
+        if j >= 0 and est_mtrx[i, j] < max_distance: # пары дальше порога не связываем
+            slots[i, head] = new_humans[j] # помещаем человека j на последний кадр в слот i
+            slot_state[i] = 1
+            matched_candidates[j] = True
+
+    # несвязанные кандидаты начинают новые треки в свободных слотах за живыми
+    count = live_count
+    for j in range(candidates_count):
+        if matched_candidates[j]:
+            continue
+        if count == slots.shape[0]: # слоты кончились
+            break
+        slots[count] = 0. # история от удаленного трека новому не достается
+        slots[count, head] = new_humans[j]
+        slot_state[count] = 2
+        count += 1
+    prev_persons_count[0] = count
+
+    # запоминаем, где видели найденные треки
+    for i in range(count):
+        if slot_state[i]:
+            anchors[i, 0] = slots[i, head, track_limb[0]]
+            anchors[i, 1] = slots[i, head, track_limb[1]]
+
+
+@kernel()
+def fast_track_center(person, track_limb):
+    '''Центр точек track_limb (бедер), ненайденные точки (нули) не учитываются'''
+    cx, cy, n = 0., 0., 0
+    for k in range(track_limb.shape[0]):
+        if person[track_limb[k], 0] > 0 or person[track_limb[k], 1] > 0:
+            cx += person[track_limb[k], 0]
+            cy += person[track_limb[k], 1]
+            n += 1
+    if n == 0:
+        return 0., 0., False
+    return cx / n, cy / n, True
+
+
+@kernel()
+def fast_kalman_predict(states, covariances, last_seen, last_centers, anchors, count, track_limb, process_noise):
+    '''Шаг модели постоянной скорости для всех живых треков: состояние (cx, cy, vx, vy) центра бедер.
+    В anchors кладутся точки track_limb последнего увиденного скелета, сдвинутые в предсказанный центр'''
+    for i in range(count):
+        x = states[i]
+        P = covariances[i]
+        x[0] += x[2]
+        x[1] += x[3]
+        # P = F P F^T + Q, F добавляет скорость к положению
+        for c in range(4):
+            P[0, c] += P[2, c]
+            P[1, c] += P[3, c]
+        for r in range(4):
+            P[r, 0] += P[r, 2]
+            P[r, 1] += P[r, 3]
+        for k in range(4):
+            P[k, k] += process_noise
+        dx, dy = x[0] - last_centers[i, 0], x[1] - last_centers[i, 1]
+        for k in range(anchors.shape[1]):
+            anchors[i, k, 0] = last_seen[i, track_limb[k], 0] + dx
+            anchors[i, k, 1] = last_seen[i, track_limb[k], 1] + dy
+
+
+@kernel()
+def fast_kalman_correct(slots, head, states, covariances, last_seen, last_centers, slot_state, count, track_limb,
+                        measurement_noise, initial_variance):
+    '''Уточняет найденные треки по измеренному центру, заводит состояние новым, а пропущенные
+    ведет по предсказанию: вместо нулей в кадр пишется последний скелет, сдвинутый в предсказанный центр'''
+    for i in range(count):
+        x = states[i]
+        P = covariances[i]
+        if slot_state[i] == 0:
+            dx, dy = x[0] - last_centers[i, 0], x[1] - last_centers[i, 1]
+            for k in range(slots.shape[2]):
+                if last_seen[i, k, 0] > 0 or last_seen[i, k, 1] > 0:
+                    slots[i, head, k, 0] = last_seen[i, k, 0] + dx
+                    slots[i, head, k, 1] = last_seen[i, k, 1] + dy
+            continue
+
+        cx, cy, found = fast_track_center(slots[i, head], track_limb)
+        if slot_state[i] == 2: # новый трек: скорость неизвестна
+            x[0], x[1], x[2], x[3] = cx, cy, 0., 0.
+            P[:] = 0.
+            for k in range(4):
+                P[k, k] = initial_variance
+        elif found:
+            # S = H P H^T + R, H берет положение; K = P H^T S^-1
+            s00, s01 = P[0, 0] + measurement_noise, P[0, 1]
+            s10, s11 = P[1, 0], P[1, 1] + measurement_noise
+            det = s00*s11 - s01*s10
+            i00, i01, i10, i11 = s11/det, -s01/det, -s10/det, s00/det
+            y0, y1 = cx - x[0], cy - x[1]
+            K = np.empty((4, 2), dtype=P.dtype)
+            for r in range(4):
+                K[r, 0] = P[r, 0]*i00 + P[r, 1]*i10
+                K[r, 1] = P[r, 0]*i01 + P[r, 1]*i11
+            for r in range(4):
+                x[r] += K[r, 0]*y0 + K[r, 1]*y1
+            top = P[:2].copy()
+            for r in range(4):
+                for c in range(4):
+                    P[r, c] -= K[r, 0]*top[0, c] + K[r, 1]*top[1, c]
+        if found or slot_state[i] == 2:
+            last_seen[i] = slots[i, head]
+            last_centers[i, 0], last_centers[i, 1] = cx, cy
+
+
+@kernel()
+def fast_associate(new_humans, slots, head, anchors, matrix, prev_persons_count, track_limb, max_distance,
+                   slot_state, states, covariances, last_seen, last_centers,
+                   process_noise, measurement_noise, initial_variance):
+    '''Связывание за один вызов: предсказание Калмана, распределение кандидатов, поправка.
+    Последовательное, поэтому собирается и в AOT-модуль'''
+    fast_kalman_predict(states, covariances, last_seen, last_centers, anchors,
+                        prev_persons_count[0], track_limb, process_noise)
+    fast_distribute(new_humans, slots, head, anchors, matrix, prev_persons_count, track_limb, max_distance, slot_state)
+    fast_kalman_correct(slots, head, states, covariances, last_seen, last_centers, slot_state, prev_persons_count[0],
+                        track_limb, measurement_noise, initial_variance)
+
+
+@kernel(parallel=True)
+def fast_normalize_pack(slots, normalized, head, slot_state, count, rects, output):
+    '''Нормализация нового кадра и сборка окон от старого кадра к новому прямо в output,
+    который классификатор читает через torch.from_numpy без копий. Параллельно по трекам'''
+    # кольцо разворачивается двумя непрерывными кусками, плоские циклы компилятор векторизует
+    ring = normalized.reshape(normalized.shape[0], -1)
+    packed = output.reshape(output.shape[0], -1)
+    split = (head + 1) * slots.shape[2] * slots.shape[3]
+    tail = ring.shape[1] - split
+    for k in prange(count):
+        if slot_state[k] == 2: # история от удаленного трека новому не достается
+            ring[k] = 0.
+        fast_normalize_frame(slots[k, head], normalized[k, head], rects[k])
+        for x in range(tail):
+            packed[k, x] = ring[k, split + x]
+        for x in range(split):
+            packed[k, tail + x] = ring[k, x]
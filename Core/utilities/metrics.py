@@ -0,0 +1,136 @@
+from time import time
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+import numpy as np
+import Core.utilities.config as cfg
+
+
+class Histogram:
+    '''Накопительные бакеты в духе Prometheus + скользящее окно последних значений для перцентилей'''
+    def __init__(self, window=cfg.METRICS_WINDOW, buckets=cfg.METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets) # значение попадает в первый бакет с le >= value
+        self.count = 0
+        self.sum = 0.
+        self.__window = deque(maxlen=window)
+        self.__lock = Lock()
+
+    def observe(self, value):
+        with self.__lock:
+            idx = bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                self.bucket_counts[idx] += 1
+            self.count += 1
+            self.sum += value
+            self.__window.append(value)
+
+    def percentiles(self, qs=(50, 95, 99)):
+        with self.__lock:
+            window = np.array(self.__window)
+        if not len(window):
+            return {q: 0. for q in qs}
+        return dict(zip(qs, np.percentile(window, qs)))
+
+    def snapshot(self):
+        with self.__lock:
+            return list(self.bucket_counts), self.count, self.sum
+
+
+class Timer:
+    def __init__(self, registry, stream, stage):
+        self.registry = registry
+        self.stream = stream
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stream, self.stage, time() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    '''Задержки стадий по потокам + простые счетчики/датчики, отдаются в текстовом формате Prometheus'''
+    def __init__(self, prefix='chii'):
+        self.prefix = prefix
+        self.__histograms = {} # (поток, стадия) -> Histogram
+        self.__gauges = {} # (имя, поток, очередь или None) -> значение
+        self.__lock = Lock()
+
+    def getHistogram(self, stream, stage):
+        key = (str(stream), stage)
+        histogram = self.__histograms.get(key)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, stream, stage, seconds):
+        self.getHistogram(stream, stage).observe(seconds)
+
+    def timer(self, stream, stage):
+        return Timer(self, stream, stage)
+
+    def setGauge(self, name, stream, value, queue=None):
+        self.__gauges[(name, str(stream), queue)] = value
+
+    def removeStream(self, stream):
+        stream = str(stream)
+        with self.__lock:
+            for key in [key for key in self.__histograms if key[0] == stream]:
+                del self.__histograms[key]
+            for key in [key for key in self.__gauges if key[1] == stream]:
+                del self.__gauges[key]
+
+    def getSummary(self, stream=None):
+        '''Словарь {поток: {стадия: {count, mean, p50, p95, p99}}} для логов и бенчмарков'''
+        summary = {}
+        for (name, stage), histogram in list(self.__histograms.items()):
+            if stream is not None and name != str(stream):
+                continue
+            _, count, total = histogram.snapshot()
+            stats = {'count': count, 'mean': total / count if count else 0.}
+            stats.update({f'p{q}': value for q, value in histogram.percentiles().items()})
+            summary.setdefault(name, {})[stage] = stats
+        return summary
+
+    def toPrometheus(self):
+        lines = []
+        name = f'{self.prefix}_stage_latency_seconds'
+        lines.append(f'# HELP {name} Per-stage processing latency.')
+        lines.append(f'# TYPE {name} histogram')
+        histograms = sorted(list(self.__histograms.items()), key=lambda item: item[0])
+        for (stream, stage), histogram in histograms:
+            labels = f'stream="{stream}",stage="{stage}"'
+            bucket_counts, count, total = histogram.snapshot()
+            cumulative = 0
+            for le, bucket_count in zip(histogram.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {total}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+
+        name = f'{self.prefix}_stage_latency_rolling_seconds'
+        lines.append(f'# HELP {name} Per-stage latency percentiles over the last {cfg.METRICS_WINDOW} frames.')
+        lines.append(f'# TYPE {name} gauge')
+        for (stream, stage), histogram in histograms:
+            for q, value in histogram.percentiles().items():
+                lines.append(f'{name}{{stream="{stream}",stage="{stage}",quantile="{q/100}"}} {value}')
+
+        gauges = {}
+        for (gauge, stream, queue), value in list(self.__gauges.items()):
+            gauges.setdefault(gauge, []).append((stream, queue, value))
+        for gauge, values in sorted(gauges.items()):
+            name = f'{self.prefix}_{gauge}'
+            lines.append(f'# TYPE {name} gauge')
+            for stream, queue, value in sorted(values, key=lambda item: (item[0], str(item[1]))):
+                labels = f'stream="{stream}"' + (f',queue="{queue}"' if queue is not None else '')
+                lines.append(f'{name}{{{labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry() # общий реестр процесса, его читает /metrics во Flask
@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import Core.utilities.config as cfg
+
+
+class MotionGate:
+    '''Дешевая проверка перед YOLO: разница уменьшенного серого кадра с последним проанализированным.
+    Кадр можно пропустить, только если сцена не изменилась, а решение о людях в кадре принимает Main'''
+    def __init__(self,
+                 width=cfg.MOTION_GATE_WIDTH,
+                 pixel_threshold=cfg.MOTION_GATE_PIXEL_THRESHOLD,
+                 area_threshold=cfg.MOTION_GATE_AREA_THRESHOLD,
+                 refresh_interval=cfg.MOTION_GATE_REFRESH_INTERVAL):
+        self.width = width # ширина уменьшенного кадра, высота по пропорциям
+        self.pixel_threshold = pixel_threshold # разница яркости, с которой пиксель считается изменившимся
+        self.area_threshold = area_threshold # доля изменившихся пикселей, начиная с которой есть движение
+        self.refresh_interval = refresh_interval # секунды, после которых кадр анализируется в любом случае
+        self.__reference = None
+        self.__reference_time = None
+        self.skipped = 0
+
+    def reset(self):
+        self.__reference = None
+
+    def __prepare(self, frame):
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0) # гасим шум матрицы и компрессии
+
+    def check(self, frame, now, force=False):
+        '''True, если кадр нужно отдать в YOLO. Такой кадр становится новым эталоном'''
+        small = self.__prepare(frame)
+        due = (force or self.__reference is None or self.__reference.shape != small.shape
+               or now - self.__reference_time >= self.refresh_interval)
+        if not due:
+            changed = np.count_nonzero(cv2.absdiff(small, self.__reference) > self.pixel_threshold)
+            due = changed > self.area_threshold * small.size
+        if due:
+            self.__reference, self.__reference_time = small, now
+        else:
+            self.skipped += 1
+        return due
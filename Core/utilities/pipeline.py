@@ -0,0 +1,82 @@
+from collections import deque
+from threading import Thread, Condition
+
+
+DROP_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+
+class StageQueue:
+    '''Ограниченная очередь между стадиями конвейера с политикой сброса'''
+    def __init__(self, depth=2, drop_policy='drop_oldest'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'Unknown drop policy: {drop_policy}. Allowed: {DROP_POLICIES}')
+        self.depth = max(1, depth)
+        self.drop_policy = drop_policy
+        self.dropped = 0 # сколько элементов выброшено из-за переполнения
+        self.__items = deque()
+        self.__cond = Condition()
+        self.__closed = False
+
+    def __len__(self):
+        return len(self.__items)
+
+    def put(self, item):
+        with self.__cond:
+            if self.__closed: # закрытая очередь ничего не теряет и не считает сброшенным
+                return False
+            if self.drop_policy == 'block':
+                self.__cond.wait_for(lambda: len(self.__items) < self.depth or self.__closed)
+            elif len(self.__items) >= self.depth:
+                self.dropped += 1
+                if self.drop_policy == 'drop_newest':
+                    return False # новый элемент не кладем
+                self.__items.popleft() # выкидываем самый старый
+            if self.__closed:
+                return False
+            self.__items.append(item)
+            self.__cond.notify_all()
+            return True
+
+    def get(self):
+        '''Блокируется до прихода элемента, возвращает None после close и опустошения'''
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__items or self.__closed)
+            if not self.__items:
+                return None
+            item = self.__items.popleft()
+            self.__cond.notify_all() # освобождаем место для put в режиме block
+            return item
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+
+class Stage(Thread):
+    '''Стадия конвейера: берет пакет из in_queue, обрабатывает func, кладет в out_queue'''
+    def __init__(self, name, func, in_queue, out_queue=None, on_error=None):
+        Thread.__init__(self, name=name, daemon=True)
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.on_error = on_error # будит владельца конвейера, тот проверяет error
+        self.error = None # исключение, на котором стадия остановилась
+
+    def run(self):
+        try:
+            while True:
+                packet = self.in_queue.get()
+                if packet is None: # очередь закрыта
+                    break
+                packet = self.func(packet)
+                if packet is not None and self.out_queue is not None:
+                    self.out_queue.put(packet)
+        except Exception as e: # иначе поток стадии молча умирает, а конвейер стоит
+            self.error = e
+        finally:
+            self.in_queue.close() # чтобы предыдущая стадия не зависла на put
+            if self.out_queue is not None:
+                self.out_queue.close() # останавливаем следующую стадию
+        if self.error is not None and self.on_error is not None:
+            self.on_error(self)
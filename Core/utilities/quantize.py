@@ -0,0 +1,221 @@
+'''
+Статическое INT8-квантование YOLO pose для CPU через ONNX Runtime.
+Калибровка идет на кадрах из наших видео в __Inputs, рядом с моделью пишется отчет
+с ошибкой точек и FPS относительно FP32, чтобы решать по каждому объекту отдельно.
+
+    python -m Core.utilities.quantize
+    python -m Core.utilities.quantize --videos __Inputs/check.mp4 --calibration-frames 300 --eval-frames 100
+
+После этого модель подключается через PoseEstimator(backend='onnx_int8') или POSE_BACKEND = 'onnx_int8'.
+'''
+import os
+import sys
+import glob
+import json
+import argparse
+from time import time
+import cv2
+import numpy as np
+import Core.utilities.config as cfg
+from Core.PoseEstimator import PoseEstimator, exportModel, getExportedPath
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+
+def findVideos(directory=cfg.INPUTS_DIR):
+    return sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                  if path.lower().endswith(VIDEO_EXTENSIONS))
+
+
+def sampleFrames(paths, count, start=0., end=1.):
+    '''Равномерно выбирает count кадров по всем видео, чтобы калибровка видела разные сцены.
+    Берется только отрезок [start, end) каждого видео в долях его длины'''
+    per_video = max(1, count // max(len(paths), 1))
+    frames = []
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        first, last = int(total * start), max(int(total * end), int(total * start) + 1)
+        step = max(1, (last - first) // per_video)
+        for idx in range(first, last, step)[:per_video]:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        cap.release()
+    return frames[:count]
+
+
+def letterbox(frame, imgsz=cfg.POSE_IMGSZ):
+    '''Та же подготовка, что у ultralytics: вписать с сохранением пропорций, серые поля, RGB, NCHW, [0, 1]'''
+    h, w = frame.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_h, new_w = round(h * scale), round(w * scale)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top+new_h, left:left+new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.
+
+
+class FramesCalibrationReader:
+    '''CalibrationDataReader для onnxruntime: по одному подготовленному кадру за вызов'''
+    def __init__(self, frames, input_name, imgsz=cfg.POSE_IMGSZ):
+        self.frames = frames
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.__idx = 0
+
+    def get_next(self):
+        if self.__idx >= len(self.frames):
+            return None
+        self.__idx += 1
+        return {self.input_name: letterbox(self.frames[self.__idx-1], self.imgsz)}
+
+    def rewind(self):
+        self.__idx = 0
+
+
+def quantizeModel(fp32_path, int8_path, frames, imgsz=cfg.POSE_IMGSZ):
+    try:
+        import onnx
+        import onnxruntime
+        from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    except ImportError as e:
+        raise ImportError('INT8 quantization needs onnx and onnxruntime: pip install onnx onnxruntime') from e
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(fp32_path, int8_path,
+                    FramesCalibrationReader(frames, input_name, imgsz),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True)
+
+    # ultralytics берет имена классов, imgsz и kpt_shape из metadata_props, квантование их теряет
+    source, quantized = onnx.load(fp32_path), onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+
+def matchPersons(reference, candidate):
+    '''Жадно сопоставляет людей по центрам скелетов, возвращает пары индексов'''
+    if not len(reference) or not len(candidate):
+        return []
+    centers_ref = reference[:, :, :2].mean(axis=1)
+    centers_cand = candidate[:, :, :2].mean(axis=1)
+    distances = np.linalg.norm(centers_ref[:, None] - centers_cand[None], axis=-1)
+    pairs = []
+    for _ in range(min(len(reference), len(candidate))):
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        pairs.append((i, j))
+        distances[i, :] = distances[:, j] = np.inf
+    return pairs
+
+
+def measureFPS(pe, frames):
+    '''FPS одной позы, без трекера и классификатора'''
+    start = time()
+    for frame in frames:
+        pe.processFrame(frame, render=False)
+    return len(frames) / (time() - start)
+
+
+def measurePipelineFPS(pe, frames, warmup=5):
+    '''FPS всего Main: поза, трекер и классификатор, как на объекте, только без отрисовки'''
+    from Core.Main import Main
+    from Core.utilities.metrics import METRICS
+    model = Main(names_of_classes=cfg.CLASSES,
+                 max_persons_count=cfg.MAX_PERSON_COUNT,
+                 frame_steps=cfg.SEQ_LENGTH,
+                 classifier_neurons=cfg.CLASSIFIER_NEURONS,
+                 classifier_weights_path=cfg.CLASSIF_MODEL if os.path.exists(cfg.CLASSIF_MODEL) else None,
+                 pose_estimator=pe,
+                 headless=True,
+                 stream_id=f'quantize-{pe.backend}')
+    for frame in frames[:warmup]: # прогрев torch/numba не должен попадать в замер
+        model.processFrame(frame)
+    start = time()
+    for frame in frames:
+        model.processFrame(frame)
+    elapsed = time() - start
+    METRICS.removeStream(model.stream_id)
+    return len(frames) / elapsed
+
+
+def compareModels(fp32, int8, frames, min_confidence=0.5):
+    '''Ошибка точек INT8 относительно FP32 в пикселях и в долях диагонали бокса,
+    плюс FPS обеих моделей: одной позы и всего конвейера'''
+    errors, relative_errors, missed, extra = [], [], 0, 0
+    for frame in frames:
+        _, ref_kps, ref_boxes = fp32.processFrame(frame, render=False)
+        _, kps, _ = int8.processFrame(frame, render=False)
+        ref_kps = ref_kps if ref_kps.size else ref_kps.reshape(0, cfg.BODY_POINTS_NUM, 3)
+        kps = kps if kps.size else kps.reshape(0, cfg.BODY_POINTS_NUM, 3)
+        pairs = matchPersons(ref_kps, kps)
+        missed += len(ref_kps) - len(pairs)
+        extra += len(kps) - len(pairs)
+        for i, j in pairs:
+            visible = ref_kps[i, :, 2] >= min_confidence
+            if not visible.any():
+                continue
+            error = np.linalg.norm(ref_kps[i, visible, :2] - kps[j, visible, :2], axis=-1).mean()
+            diagonal = np.linalg.norm(ref_boxes[i, 2:] - ref_boxes[i, :2])
+            errors.append(float(error))
+            relative_errors.append(float(error / diagonal) if diagonal else 0.)
+
+    fps_fp32, fps_int8 = measureFPS(fp32, frames), measureFPS(int8, frames)
+    pipeline_fp32, pipeline_int8 = measurePipelineFPS(fp32, frames), measurePipelineFPS(int8, frames)
+    return {'frames': len(frames),
+            'matched_persons': len(errors),
+            'missed_persons': missed,
+            'extra_persons': extra,
+            'keypoint_error_px': {'mean': float(np.mean(errors)) if errors else None,
+                                  'p95': float(np.percentile(errors, 95)) if errors else None},
+            'keypoint_error_relative': {'mean': float(np.mean(relative_errors)) if errors else None,
+                                        'p95': float(np.percentile(relative_errors, 95)) if errors else None},
+            'pose_fps': {'fp32': fps_fp32, 'int8': fps_int8, 'speedup': fps_int8 / fps_fp32},
+            'end_to_end_fps': {'fp32': pipeline_fp32, 'int8': pipeline_int8, 'speedup': pipeline_int8 / pipeline_fp32}}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Chii INT8 pose quantization')
+    parser.add_argument('--weights', default=cfg.YOLO_MODEL_PATH)
+    parser.add_argument('--videos', nargs='*', help=f'Calibration videos, by default everything in {cfg.INPUTS_DIR}')
+    parser.add_argument('--imgsz', type=int, default=cfg.POSE_IMGSZ)
+    parser.add_argument('--calibration-frames', type=int, default=200)
+    parser.add_argument('--eval-frames', type=int, default=100)
+    parser.add_argument('--report', help='Where to write the JSON report, by default next to the INT8 model')
+    args = parser.parse_args()
+
+    videos = args.videos or findVideos()
+    if not videos:
+        print(f'No calibration videos found in {cfg.INPUTS_DIR}')
+        return 1
+    # калибровка с начала каждого видео, оценка с конца: соседние кадры почти одинаковы и завысили бы точность
+    split = args.calibration_frames / (args.calibration_frames + args.eval_frames)
+    calibration = sampleFrames(videos, args.calibration_frames, 0., split)
+    evaluation = sampleFrames(videos, args.eval_frames, split, 1.)
+    print(f'Calibrating on {len(calibration)} frames, evaluating on {len(evaluation)} frames from {len(videos)} videos')
+
+    fp32_path = exportModel(args.weights, 'onnx')
+    int8_path = quantizeModel(fp32_path, getExportedPath(args.weights, 'onnx_int8'), calibration, args.imgsz)
+    print(f'INT8 model written to {int8_path}')
+
+    report = compareModels(PoseEstimator(fp32_path, imgsz=args.imgsz, backend='onnx'),
+                           PoseEstimator(int8_path, imgsz=args.imgsz, backend='onnx_int8'),
+                           evaluation)
+    report.update({'fp32_model': fp32_path, 'int8_model': int8_path,
+                   'videos': videos, 'calibration_frames': len(calibration), 'imgsz': args.imgsz})
+
+    text = json.dumps(report, indent=2)
+    with open(args.report or os.path.splitext(int8_path)[0] + '_report.json', 'w', encoding='utf-8') as file:
+        file.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
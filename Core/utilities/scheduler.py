@@ -0,0 +1,81 @@
+from time import time
+import Core.utilities.config as cfg
+
+
+class FrameScheduler:
+    '''Выдает кадры на анализ с равным шагом по времени и при устойчивой перегрузке
+    спускается по лестнице деградации (ниже FPS, меньше вход YOLO, меньше людей), а потом возвращается'''
+    def __init__(self,
+                 target_fps=cfg.ANALYSIS_FPS,
+                 ladder=cfg.DEGRADATION_LADDER,
+                 overload_ratio=cfg.SCHEDULER_OVERLOAD_RATIO,
+                 recover_ratio=cfg.SCHEDULER_RECOVER_RATIO,
+                 patience=cfg.SCHEDULER_PATIENCE,
+                 smoothing=cfg.SCHEDULER_SMOOTHING,
+                 on_level_change=None):
+        self.target_fps = target_fps
+        self.ladder = ladder # уровни: доля target_fps, размер входа YOLO, максимум людей
+        self.overload_ratio = overload_ratio # перегрузка: время кадра > бюджет * overload_ratio
+        self.recover_ratio = recover_ratio # запас: время кадра < бюджет уровня выше * recover_ratio
+        self.patience = patience # сколько кадров подряд должно выполняться условие
+        self.smoothing = smoothing
+        self.on_level_change = on_level_change
+        self.level = 0
+        self.__resetCounters()
+        self.__next_due = None
+
+    def __resetCounters(self):
+        self.__latency = None # сглаженное время обработки кадра
+        self.__overloaded = 0
+        self.__relaxed = 0
+
+    def getLevel(self):
+        return self.ladder[self.level]
+
+    def getFPS(self, level=None):
+        return self.target_fps * self.ladder[self.level if level is None else level]['fps_scale']
+
+    def getInterval(self):
+        return 1. / self.getFPS()
+
+    def isDue(self, now=None):
+        '''True, если кадр с меткой now пора отдавать на анализ'''
+        now = time() if now is None else now
+        interval = self.getInterval()
+        if self.__next_due is None or now - self.__next_due > interval: # старт или сильно отстали
+            self.__next_due = now
+        if now < self.__next_due:
+            return False
+        self.__next_due += interval # шаг от расписания, а не от факта, чтобы не накапливать дрожание
+        return True
+
+    def reportLatency(self, seconds):
+        '''Вызывается после каждого обработанного кадра, возвращает текущий уровень'''
+        if self.__latency is None:
+            self.__latency = seconds
+        else:
+            self.__latency += self.smoothing * (seconds - self.__latency)
+
+        if self.__latency > self.getInterval() * self.overload_ratio:
+            self.__overloaded += 1
+            self.__relaxed = 0
+        elif self.level > 0 and self.__latency < self.recover_ratio / self.getFPS(self.level-1):
+            self.__relaxed += 1
+            self.__overloaded = 0
+        else:
+            self.__overloaded = self.__relaxed = 0
+
+        if self.__overloaded >= self.patience and self.level < len(self.ladder)-1:
+            self.__setLevel(self.level+1, 'overload')
+        elif self.__relaxed >= self.patience:
+            self.__setLevel(self.level-1, 'recovered')
+        return self.getLevel()
+
+    def __setLevel(self, level, reason):
+        old_level, latency = self.level, self.__latency
+        self.level = level
+        self.__resetCounters()
+        print(f'FrameScheduler: level {old_level} -> {level} ({reason}, '
+              f'frame time {latency*1000:.1f} ms): {self.getFPS():.1f} FPS, {self.getLevel()}')
+        if self.on_level_change:
+            self.on_level_change(old_level, level, reason)
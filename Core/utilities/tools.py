@@ -1,4 +1,12 @@
 import cv2
+import numpy as np
+
+
+def resized(array, capacity, count):
+    '''Новый массив на capacity слотов, первые count слотов переносятся, остальные нулевые'''
+    result = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    result[:count] = array[:count]
+    return result
 
 
 def drawRectangle(image, left, top, right, bottom, title=None,
@@ -27,6 +27,96 @@ class Cropper:
         return img
 
 
+class ZoneCropper:
+    '''Зоны интереса камеры: прямоугольники [x, y, w, h] или многоугольники [[x, y], ...] плюс общий масштаб.
+    Каждая зона вырезается Cropper, вне многоугольника зануляется и уменьшается Scaler,
+    а найденные в ней точки и рамки переводятся обратно в координаты полного кадра.
+    Зоны не должны пересекаться, иначе человек на стыке будет найден дважды.
+    frame_size (ширина, высота) необязателен: с ним зоны за краем кадра отсеиваются сразу, а не на первом кадре'''
+    def __init__(self, regions, scale_factor=1., frame_size=None):
+        if scale_factor <= 0:
+            raise ValueError(f'Zone scale must be positive, got {scale_factor}')
+        self.scale_f = scale_factor
+        self.scaler = Scaler(scale_factor) if scale_factor != 1 else None
+        self.croppers, self.polygons, self.masks = [], [], []
+        for region in regions:
+            region = np.array(region, dtype=np.int32)
+            if region.ndim == 1: # прямоугольник
+                x, y, w, h = region
+            else:
+                x, y = region.min(axis=0)
+                w, h = region.max(axis=0) - (x, y)
+            # иначе маска и вырезка разойдутся по размеру и зона тихо потеряет часть площади
+            if x < 0 or y < 0 or w <= 0 or h <= 0:
+                raise ValueError(f'Zone {region.tolist()} has negative coordinates or zero size')
+            if frame_size is not None and (x + w > frame_size[0] or y + h > frame_size[1]):
+                raise ValueError(f'Zone {region.tolist()} does not fit into the {frame_size[0]}x{frame_size[1]} frame')
+            if region.ndim == 1:
+                polygon = np.array([[x, y], [x+w, y], [x+w, y+h], [x, y+h]], dtype=np.int32)
+                mask = None
+            else:
+                polygon = region
+                mask = np.zeros((h, w), dtype=np.uint8)
+                cv2.fillPoly(mask, [region - (x, y)], 255)
+            self.croppers.append(Cropper(int(x), int(y), int(w), int(h)))
+            self.polygons.append(polygon)
+            self.masks.append(mask)
+
+    @classmethod
+    def fromConfig(cls, config):
+        '''{"regions": [[x, y, w, h], [[x, y], [x, y], [x, y]]], "scale": 0.5, "frame_size": [1280, 720]}'''
+        return cls(config['regions'], config.get('scale', 1.), config.get('frame_size'))
+
+    def __len__(self):
+        return len(self.croppers)
+
+    def getInputSize(self, max_imgsz, stride=32):
+        '''Вход YOLO для батча зон: по большей стороне самой крупной зоны после масштаба, кратно stride.
+        Иначе LetterBox растянет каждую зону до полного imgsz и уменьшение ничего не сэкономит'''
+        side = max(max(c.x2 - c.x1, c.y2 - c.y1) for c in self.croppers) * self.scale_f
+        return min(max_imgsz, max(stride, int(np.ceil(side / stride)) * stride))
+
+    def __call__(self, img):
+        crops = []
+        for cropper, mask in zip(self.croppers, self.masks):
+            crop = cropper(img)
+            if crop.shape[:2] != (cropper.y2 - cropper.y1, cropper.x2 - cropper.x1):
+                raise ValueError(f'Zone {[cropper.x1, cropper.y1, cropper.x2, cropper.y2]} does not fit into '
+                                 f'the {img.shape[1]}x{img.shape[0]} frame')
+            if mask is not None:
+                crop = cv2.bitwise_and(crop, crop, mask=mask)
+            crops.append(self.scaler(crop) if self.scaler is not None else crop)
+        return crops
+
+    def toFrame(self, zone_idx, keypoints, boxes):
+        '''Переводит точки (P, 17, 3) и рамки (P, 4) зоны в координаты кадра на месте.
+        Ненайденные точки YOLO отдает нулями, трекер их так и понимает, поэтому их не сдвигаем'''
+        cropper = self.croppers[zone_idx]
+        found = (keypoints[..., 0] > 0) | (keypoints[..., 1] > 0)
+        keypoints[..., :2] /= self.scale_f
+        keypoints[..., 0] += cropper.x1 * found
+        keypoints[..., 1] += cropper.y1 * found
+        boxes /= self.scale_f
+        boxes += (cropper.x1, cropper.y1, cropper.x1, cropper.y1)
+        return keypoints, boxes
+
+    def paste(self, img, zone_idx, crop):
+        '''Возвращает в кадр отрисованную зону (например, со скелетами) на ее место'''
+        cropper, mask = self.croppers[zone_idx], self.masks[zone_idx]
+        target = cropper(img)
+        if self.scaler is not None:
+            crop = cv2.resize(crop, (target.shape[1], target.shape[0]))
+        if mask is None:
+            target[:] = crop
+        else:
+            mask = mask > 0
+            target[mask] = crop[mask]
+        return img
+
+    def drawOutlines(self, img, color=(0, 255, 255), thickness=2):
+        return cv2.polylines(img, self.polygons, isClosed=True, color=color, thickness=thickness)
+
+
 class RandomAmputation2:
     def __init__(self, amp_bnd, prob=0.25):
         self.amp_bnd = amp_bnd
@@ -15,6 +15,8 @@ from passlib.hash import bcrypt
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from Core import Main as CoreMain
 from Core.utilities import config as cfg
+from Core.utilities.scheduler import FrameScheduler
+from Core.utilities.metrics import METRICS
 import boto3
 from botocore.client import Config
 from botocore.exceptions import NoCredentialsError, ClientError
@@ -97,12 +99,11 @@ processing_state = {
     "input_path": None, 
     "is_running": False,
     "error": None,
-    "last_frame": None, 
     "source_type": None, 
-    "user_id_who_started_processing": None 
+    "user_id_who_started_processing": None,
+    "analysis_level": None # текущая ступень лестницы деградации
 
 }
-frame_lock = threading.Lock() 
 
 
 def upload_file_to_s3(file_path, bucket_name, object_name=None):
@@ -113,7 +114,8 @@ def upload_file_to_s3(file_path, bucket_name, object_name=None):
     if object_name is None:
         object_name = os.path.basename(file_path)
     try:
-        s3_client.upload_file(file_path, bucket_name, object_name)
+        with METRICS.timer('webapp', 's3_upload'):
+            s3_client.upload_file(file_path, bucket_name, object_name)
         # URL для доступа к файлу (может зависеть от настроек MinIO и прокси)
         file_url = f"{app.config['S3_ENDPOINT_URL']}/{bucket_name}/{object_name}"
         print(f"File {file_path} uploaded to {bucket_name}/{object_name}. URL: {file_url}")
@@ -227,11 +229,20 @@ def run_model_thread(source_path_or_url, source_type, user_id_who_started):
         
 
         
+        def on_level_change(old_level, new_level, reason):
+            processing_state["analysis_level"] = new_level
+
+        scheduler = FrameScheduler(on_level_change=on_level_change)
+        processing_state["analysis_level"] = scheduler.level
         model = CoreMain(
             max_persons_count=cfg.MAX_PERSON_COUNT,
             names_of_classes=cfg.CLASSES,
             frame_steps=cfg.SEQ_LENGTH, 
-            classifier_neurons=cfg.CLASSIFIER_NEURONS
+            classifier_neurons=cfg.CLASSIFIER_NEURONS,
+            headless=True, # кадры рисуются, только пока открыт /video_feed
+            scheduler=scheduler,
+            motion_gate=True, # пустые неподвижные кадры не гоняем через YOLO
+            stream_id=source_type # URL не кладем в метки метрик, в нем бывают пароли
         )
         processing_state["model_instance"] = model
         model.start()
@@ -250,11 +261,15 @@ def run_model_thread(source_path_or_url, source_type, user_id_who_started):
         print(f"Successfully opened source: {source_path_or_url}")
         fps = cap.get(cv2.CAP_PROP_FPS)
         last_anomaly_save_time = None 
+        last_result_id = 0
         ANOMALY_SAVE_COOLDOWN_SECONDS = 10 # Сохранять кадр аномалии не чаще чем раз в 10 секунд
         print(f"Source FPS: {fps if fps > 0 else 'N/A (likely stream)'}")
 
         while processing_state["is_running"] and cap.isOpened():
+            capture_start = time.time()
             ret, original_frame = cap.read() 
+            capture_time = time.time()
+            METRICS.observe(source_type, 'capture', capture_time - capture_start)
             if not ret: 
                 print(f"Stream ended or cannot read frame (ret is False).")
                 if source_type == 'file': break
@@ -269,9 +284,13 @@ def run_model_thread(source_path_or_url, source_type, user_id_who_started):
                 time.sleep(0.05) 
                 continue
 
-            frame_for_model = original_frame.copy() 
-            model.setFrame(frame_for_model)
+            if scheduler.isDue(): # отдаем кадры модели с ровным шагом, остальные пропускаем
+                model.setFrame(original_frame, capture_time) # модель кадр не меняет, копия не нужна
             result = model.getOutput() 
+            if result.frame_id == last_result_id: # этот результат уже разобран
+                result = None
+            else:
+                last_result_id = result.frame_id
 
             anomaly_detected_on_this_frame = False
             detected_anomaly_class_name = None
@@ -361,10 +380,6 @@ def run_model_thread(source_path_or_url, source_type, user_id_who_started):
                     else:
                         print(f"Failed to save temporary anomaly frame: {temp_frame_path}")
 
-            if result and result.get('frame') is not None:
-                with frame_lock:
-                    processing_state["last_frame"] = result['frame'].copy()
-            
             time.sleep(0.03)  
 
         print("Exited processing loop.")
@@ -386,13 +401,12 @@ def run_model_thread(source_path_or_url, source_type, user_id_who_started):
                      model_thread_instance.join(timeout=2.0) 
                  print("Model stop called.")
         
-        with frame_lock:
-            processing_state["last_frame"] = None
         processing_state["is_running"] = False
         processing_state["model_thread"] = None
         processing_state["model_instance"] = None
         processing_state["input_path"] = None
         processing_state["source_type"] = None
+        processing_state["analysis_level"] = None
         if source_type == 'file' and 'source_path_or_url' in locals() and os.path.exists(source_path_or_url):
              try:
                  
@@ -546,7 +560,6 @@ def upload_video():
             print(f"File saved to: {filepath}")
 
             # Сбрасываем состояние перед запуском
-            with frame_lock: processing_state["last_frame"] = None
             processing_state["error"] = None
             processing_state["input_path"] = filepath 
             processing_state["is_running"] = True
@@ -596,7 +609,6 @@ def start_rtsp():
 
     try:
         # Сбрасываем состояние
-        with frame_lock: processing_state["last_frame"] = None
         processing_state["error"] = None
         processing_state["input_path"] = rtsp_url # Сохранить URL
         processing_state["is_running"] = True
@@ -624,35 +636,58 @@ def video_feed():
     print(f"User {current_user_id} accessing /video_feed")
     def generate_frames():
         print("Starting MJPEG stream...")
-        while True:
-            frame_to_send = None
-            with frame_lock: # Получаем кадр под блокировкой
-                if processing_state["last_frame"] is not None:
-                    frame_to_send = processing_state["last_frame"].copy()
-
-            if frame_to_send is None:
-                
-                time.sleep(0.1) 
-                
-                if not processing_state["is_running"] and processing_state["input_path"] is None:
-                     print("Processing stopped or finished, closing stream.")
-                     break 
-                continue 
-
-            ret, buffer = cv2.imencode('.jpg', frame_to_send)
-            if not ret:
-                # print("Failed to encode frame")
-                continue # пропускает кадр если не удалось закодировать
-
-            frame_bytes = buffer.tobytes()
-            # отправка кадра в формате MJPEG
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.01) 
+        viewed_model = None # модель, у которой мы включили отрисовку
+        last_result_id = 0
+        try:
+            while True:
+                model = processing_state["model_instance"]
+                if model is not viewed_model: # модель появилась или сменилась
+                    if viewed_model is not None:
+                        viewed_model.detachViewer()
+                    if model is not None:
+                        model.attachViewer()
+                    viewed_model = model
+                    last_result_id = 0
+
+                frame_to_send = None
+                if model is not None: # ждем следующий результат модели вместо опроса со sleep
+                    result = model.waitOutput(last_result_id, timeout=0.5)
+                    if result is not None:
+                        last_result_id = result.frame_id
+                        frame_to_send = result.frame
+
+                if frame_to_send is None:
+                    
+                    if model is None or not model.is_alive():
+                        time.sleep(0.1) 
+                    
+                    if not processing_state["is_running"] and processing_state["input_path"] is None:
+                         print("Processing stopped or finished, closing stream.")
+                         break 
+                    continue 
+
+                with METRICS.timer('webapp', 'jpeg_encode'):
+                    ret, buffer = cv2.imencode('.jpg', frame_to_send)
+                if not ret:
+                    # print("Failed to encode frame")
+                    continue # пропускает кадр если не удалось закодировать
+
+                frame_bytes = buffer.tobytes()
+                # отправка кадра в формате MJPEG
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally: # клиент отключился или стрим закончился
+            if viewed_model is not None:
+                viewed_model.detachViewer()
 
     
     return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return Response(METRICS.toPrometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/status', methods=['GET'])
 @jwt_required()
 def get_status():
@@ -665,6 +700,7 @@ def get_status():
         "input_path": processing_state["input_path"], 
         "source_type": processing_state["source_type"],
         "error": processing_state["error"],
+        "analysis_level": processing_state["analysis_level"],
         # "model_active": processing_state["model_thread"] is not None and processing_state["model_thread"].is_alive()
     }
     return jsonify(status)
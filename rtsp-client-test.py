@@ -148,6 +148,9 @@ def main():
     Chii.commands.append(commandClass1)
     Chii.commands.append(commandClass2)
     
+    if previewVideo == True:
+        Chii.m.attachViewer() # без превью кадры не рисуются
+
     try:
         Chii.m.start() # запускаем отдельный поток
         while cap.isOpened():
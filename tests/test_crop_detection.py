@@ -0,0 +1,48 @@
+'''Детекция раз в N кадров по вырезкам: трек, ушедший за край кадра, не должен ронять Main'''
+import numpy as np
+import Core.utilities.config as cfg
+from Core.Main import Main
+from Core.PoseEstimator import stackPoses
+from Benchmarks.mocks import SKELETON_TEMPLATE
+
+
+class BlobPoseEstimator:
+    '''Находит одного "человека" по ярким пикселям картинки, поэтому честно видит содержимое вырезок.
+    На пустой картинке падает, как LetterBox у ultralytics'''
+    imgsz = cfg.POSE_IMGSZ
+
+    def setInputSize(self, imgsz):
+        self.imgsz = imgsz
+
+    def processFrame(self, frame, render=True):
+        if frame.shape[0] == 0 or frame.shape[1] == 0:
+            raise ZeroDivisionError('empty image')
+        ys, xs = np.nonzero(frame[:, :, 0] > 200)
+        if not len(xs):
+            return (frame.copy() if render else None,
+                    np.zeros((0, cfg.BODY_POINTS_NUM, 3), dtype=np.float32), np.zeros((0, 4), dtype=np.float32))
+        left, top, right, bottom = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        keypoints = np.empty((1, cfg.BODY_POINTS_NUM, 3), dtype=np.float32)
+        keypoints[0, :, :2] = SKELETON_TEMPLATE * (right - left, bottom - top) + (left, top)
+        keypoints[0, :, 2] = 0.9
+        boxes = np.array([[left, top, right, bottom]], dtype=np.float32)
+        return (frame.copy() if render else None), keypoints, boxes
+
+    def processFrames(self, frames, render=False):
+        return stackPoses([self.processFrame(frame, False) for frame in frames])
+
+
+def makeFrame(x, width=640, height=480, person=(40, 120)):
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[200:200+person[1], max(0, x):max(0, x+person[0])] = 255
+    return frame
+
+
+def test_track_leaving_frame_does_not_crash_crop_detection():
+    model = Main(names_of_classes=cfg.CLASSES, max_persons_count=cfg.MAX_PERSON_COUNT,
+                 frame_steps=cfg.SEQ_LENGTH, classifier_neurons=cfg.CLASSIFIER_NEURONS,
+                 classifier_weights_path=None, pose_estimator=BlobPoseEstimator(),
+                 detect_interval=3, headless=True)
+    for t in range(40): # человек уходит за правый край, Калман продолжает вести его дальше
+        output = model.processFrame(makeFrame(520 + 12 * t))
+    assert output.frame_id == 40